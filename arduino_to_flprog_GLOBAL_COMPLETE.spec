@@ -28,7 +28,7 @@ a = Analysis(
     hiddenimports=[
         'PyQt5.QtCore', 'PyQt5.QtGui', 'PyQt5.QtWidgets',
         'json', 'urllib.request', 'urllib.error', 'html', 'uuid', 'argparse',
-        're', 'traceback', 'ssl',
+        're', 'traceback', 'ssl', 'functools', 'copy', 'bisect', 'tempfile', 'dataclasses', 'io', 'itertools', 'operator', 'stat',
     ],
     hookspath=[],
     hooksconfig={},
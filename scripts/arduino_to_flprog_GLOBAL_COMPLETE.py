@@ -23,6 +23,7 @@ import argparse
 import logging
 import os
 import sys
+import traceback
 
 
 def _setup_logging():
@@ -56,9 +57,31 @@ _setup_logging()
 _log = logging.getLogger(__name__)
 sys.excepthook = _excepthook
 
-from PyQt5 import QtWidgets
-
-from gui import ArduinoToFLProgConverter
+from constants import DEFAULT_BLOCK_DESCRIPTION
+from generator import create_ubi_xml_sixx, write_ubi_file
+from parser import parse_arduino_code
+
+
+def convert_sketch(code, block_name, block_description=None, out=None):
+    """
+    Конвертация без GUI: парсит скетч и возвращает SIXX XML блока (или пишет его в out — см. create_ubi_xml_sixx).
+    Описание как в GUI: ведущий комментарий скетча, иначе block_description, иначе описание по умолчанию.
+    """
+    result = parse_arduino_code(code)
+    description = (result['leading_comment'] or block_description or '').strip() or DEFAULT_BLOCK_DESCRIPTION
+    return create_ubi_xml_sixx(
+        block_name=block_name,
+        block_description=description,
+        variables=result['variables'],
+        functions=result['functions'],
+        global_includes=result['global_includes'],
+        defines=result['defines'],
+        extra_declarations=result['extra_declarations'],
+        static_declarations=result['static_declarations'],
+        setup_code=result['setup_body'],
+        loop_code=result['loop_body'],
+        out=out,
+    )
 
 
 def main_cli():
@@ -89,6 +112,10 @@ def main_cli():
 
     if not args.input:
         _log.debug("main_cli: GUI mode")
+        # PyQt5 загружается только для GUI — CLI-конвертация обходится без него
+        from PyQt5 import QtWidgets
+        from gui import ArduinoToFLProgConverter
+
         app = QtWidgets.QApplication(sys.argv)
         _log.debug("main_cli: creating window")
         window = ArduinoToFLProgConverter()
@@ -108,36 +135,26 @@ def main_cli():
         print(f"Ошибка чтения файла '{input_path}': {e}")
         sys.exit(1)
 
-    app = QtWidgets.QApplication(sys.argv)
-    converter = ArduinoToFLProgConverter()
-
-    converter.code_input.setPlainText(code)
-
-    if args.name:
-        converter.block_name_entry.setText(args.name)
-    else:
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
-        converter.block_name_entry.setText(base_name)
-
-    if args.description:
-        converter.block_description_entry.setPlainText(args.description)
-
-    converter.parse_code()
+    block_name = args.name or os.path.splitext(os.path.basename(input_path))[0]
 
     if args.output:
         output_path = args.output
     else:
         base, _ = os.path.splitext(input_path)
         output_path = base + ".ubi"
+    if not output_path.endswith('.ubi'):
+        output_path += '.ubi'
 
-    ok, info = converter.generate_block_to_file(output_path)
-    if ok:
-        print(f"Блок успешно сохранен в формате SIXX:\n{info}")
-        sys.exit(0)
-    else:
-        print(info)
+    try:
+        write_ubi_file(output_path, lambda f: convert_sketch(code, block_name, args.description, out=f))
+    except Exception as e:
+        _log.exception("main_cli: error %s", e)
+        print("Ошибка при сохранении:\n{}\n\nПодробности:\n{}".format(e, traceback.format_exc()))
         sys.exit(1)
 
+    print(f"Блок успешно сохранен в формате SIXX:\n{output_path}")
+    sys.exit(0)
+
 
 if __name__ == "__main__":
     main_cli()
@@ -8,11 +8,14 @@ VERSION = "1.7.2"
 # GitHub-репозиторий для проверки обновлений (owner/repo)
 GITHUB_REPO = "phazz1980/ino2ubi"
 
+# Описание блока, если в скетче нет ведущего комментария и оно не задано пользователем
+DEFAULT_BLOCK_DESCRIPTION = "Автоматически сгенерированный блок"
+
 # Примитивные типы Arduino, отображаемые в таблице переменных
-PRIMITIVE_TYPES = {
+PRIMITIVE_TYPES = frozenset({
     'int', 'long', 'unsigned long', 'bool', 'boolean', 'float', 'double',
     'byte', 'char', 'String', 'uint8_t', 'int16_t', 'uint16_t', 'int32_t', 'uint32_t'
-}
+})
 
 # Порядок типов для выбора типа define в GUI (все типы переменных Arduino)
 DEFINE_TYPE_CHOICES = [
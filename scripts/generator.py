@@ -3,18 +3,143 @@
 """
 
 import html
+import io
+import os
 import re
-import uuid
+import stat
+import tempfile
+from functools import lru_cache
+from itertools import count, islice
+from operator import itemgetter
+
+try:
+    import ahocorasick  # pyahocorasick — необязательная зависимость
+except ImportError:
+    ahocorasick = None
 
 from constants import TYPE_MAPPING
 
+# Идентификатор целиком (граница слова с обеих сторон), как \bname\b
+_WORD_RE = re.compile(r'\w+')
+
+# static-объявление: "static <тип> <имя> [= значение]"
+_STATIC_PARSE_RE = re.compile(r'^\s*static\s+(.+?)\s+([a-zA-Z_][A-Za-z0-9_]*)\s*(.*)$', re.DOTALL)
+
+# Фиксированные SIXX-id, на которые ссылаются типы данных и входы/выходы любого блока
+_INSTANCE_COLL_ID = 15
+_COMMENT_STR_ID = 18
+# Ссылка на комментарий входа/выхода не зависит от блока — строка собирается один раз при импорте
+_COMMENT_REF = f'\t\t\t\t<sixx.object sixx.name="comment" sixx.idref="{_COMMENT_STR_ID}" />\n'
+
+# Ключ сортировки кортежей (position, имя, info) — C-функция вместо lambda
+_by_position = itemgetter(0)
+
+# С какого числа замен выгоднее автомат Ахо-Корасик, чем проход токенизатора
+_AHOCORASICK_MIN_RENAMES = 16
+
+
+# Экранирование кода для SIXX за один проход: символы html.escape(quote=True) + ( ) , % как в FLProg
+_SIXX_TRANS = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;',
+    '(': '&#40;', ')': '&#41;', ',': '&#44;', '%': '&#37;',
+})
+# Есть ли в тексте что экранировать (для SIXX и для html.escape)
+_SIXX_SPECIAL_RE = re.compile(r'[&<>"\'(),%]')
+_HTML_SPECIAL_RE = re.compile(r'[&<>"\']')
+
 
 def escape_code_for_sixx(text: str) -> str:
-    """Экранирование кода для SIXX: html.escape + ( ) , % как в FLProg."""
-    s = html.escape(text)
-    s = s.replace('(', '&#40;').replace(')', '&#41;')
-    s = s.replace(',', '&#44;').replace('%', '&#37;')
-    return s
+    """
+    Экранирование кода для SIXX: html.escape + ( ) , % как в FLProg.
+    Не кэшируется: сюда приходят целые тела setup/loop/функций, которые почти не повторяются.
+    """
+    if _SIXX_SPECIAL_RE.search(text) is None:
+        return text
+    return text.translate(_SIXX_TRANS)
+
+
+# Имена, типы и значения в блоке часто повторяются — экранированный вариант берём из кэша
+@lru_cache(maxsize=4096)
+def _escape_html(text: str) -> str:
+    """html.escape; строка без &<>"' возвращается как есть, без копирования."""
+    if _HTML_SPECIAL_RE.search(text) is None:
+        return text
+    return html.escape(text)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+def make_identifier_renamer(renames: dict) -> callable:
+    """
+    Возвращает функцию text -> text, заменяющую идентификаторы целиком по словарю renames (имя -> псевдоним).
+    Все замены выполняются за один проход по тексту: токенизатором по словам,
+    а при большом числе замен и установленном pyahocorasick — автоматом Ахо-Корасик.
+    """
+    if not renames:
+        return lambda text: text
+
+    if ahocorasick is None or len(renames) <= _AHOCORASICK_MIN_RENAMES:
+        def repl(match: re.Match) -> str:
+            word = match.group()
+            return renames.get(word, word)
+
+        return lambda text: _WORD_RE.sub(repl, text)
+
+    automaton = ahocorasick.Automaton()
+    for old_name, new_name in renames.items():
+        automaton.add_word(old_name, (len(old_name), new_name))
+    automaton.make_automaton()
+
+    def rename(text: str) -> str:
+        parts = []
+        last = 0
+        n = len(text)
+        for end, (length, new_name) in automaton.iter(text):
+            start = end - length + 1
+            # Совпадение должно быть целым словом, а не частью другого идентификатора
+            if start < last or (start > 0 and _is_word_char(text[start - 1])):
+                continue
+            if end + 1 < n and _is_word_char(text[end + 1]):
+                continue
+            parts.append(text[last:start])
+            parts.append(new_name)
+            last = end + 1
+        if not parts:
+            return text
+        parts.append(text[last:])
+        return ''.join(parts)
+
+    return rename
+
+
+# Пробелы в конце строк (перевод строки \n не трогаем)
+_TRAIL_WS_RE = re.compile(r'[^\S\n]+$', re.MULTILINE)
+# Разделители строк str.splitlines(), кроме \n
+_OTHER_LINE_BREAK_RE = re.compile('[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def _strip_trailing_whitespace(text: str) -> str:
+    r"""
+    То же, что '\n'.join(line.rstrip() for line in text.splitlines()), но одной заменой regex.
+    Текст с другими разделителями строк (\r, \f, ...) идёт прежним путём — они тоже превращаются в \n.
+    """
+    if _OTHER_LINE_BREAK_RE.search(text) is not None:
+        return '\n'.join(line.rstrip() for line in text.splitlines())
+    # splitlines() не даёт пустой строки после завершающего \n
+    if text.endswith('\n'):
+        text = text[:-1]
+    return _TRAIL_WS_RE.sub('', text)
+
+
+def _fast_uuid4_str(_urandom=os.urandom) -> str:
+    """Случайный UUID версии 4 строкой, как str(uuid.uuid4()), но без создания объекта UUID."""
+    b = bytearray(_urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40
+    b[8] = (b[8] & 0x3F) | 0x80
+    h = b.hex()
+    return f'{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}'
 
 
 def get_type_class_name(var_type: str) -> str:
@@ -22,23 +147,85 @@ def get_type_class_name(var_type: str) -> str:
     return TYPE_MAPPING.get(var_type, 'IntegerDataType')
 
 
+# Шаблон типа данных для каждого var_type: класс подставлен один раз, остаются три id (%d)
+_DATATYPE_TEMPLATES = {}
+
+
+def _get_datatype_template(var_type: str) -> str:
+    tpl = _DATATYPE_TEMPLATES.get(var_type)
+    if tpl is None:
+        type_class = get_type_class_name(var_type)
+        tpl = (
+            f'\t\t\t\t<sixx.object sixx.id="%d" sixx.name="type" sixx.type="{type_class} class" sixx.env="Arduino" >\n'
+            '\t\t\t\t\t<sixx.object sixx.id="%d" sixx.name="instanceCollection" sixx.type="OrderedCollection" sixx.env="Core" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="%d" sixx.type="{type_class}" sixx.env="Arduino" >\n'
+            '\t\t\t\t\t\t</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+            '\t\t\t\t</sixx.object>\n'
+        )
+        _DATATYPE_TEMPLATES[var_type] = tpl
+    return tpl
+
+
 def create_sixx_data_type(
     var_type: str,
     type_id: int,
     instance_coll_id: int,
-    next_id: callable
-) -> str:
-    """Создаёт SIXX XML для типа данных с instanceCollection."""
-    type_class = get_type_class_name(var_type)
-    instance_id = next_id()
-
-    xml = '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="type" sixx.type="{} class" sixx.env="Arduino" >\n'.format(type_id, type_class)
-    xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="instanceCollection" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(instance_coll_id)
-    xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="{}" sixx.env="Arduino" >\n'.format(instance_id, type_class)
-    xml += '\t\t\t\t\t\t</sixx.object>\n'
-    xml += '\t\t\t\t\t</sixx.object>\n'
-    xml += '\t\t\t\t</sixx.object>\n'
-    return xml
+    instance_id: int,
+    out,
+) -> None:
+    """Пишет в out SIXX XML для типа данных с instanceCollection."""
+    out.write(_get_datatype_template(var_type) % (type_id, instance_coll_id, instance_id))
+
+
+def _collection_tags(coll_id: int, name: str, items) -> tuple:
+    """
+    Открывающая и закрывающая строки коллекции блока (inputs/outputs/parametrs): непустая открывается '>'
+    и закрывается отдельной строкой, пустая целиком записывается открывающей строкой, закрывающая — ''.
+    """
+    if items:
+        return (f'\t\t<sixx.object sixx.id="{coll_id}" sixx.name="{name}" sixx.type="OrderedCollection" sixx.env="Core" >\n',
+                '\t\t</sixx.object>\n')
+    return (f'\t\t<sixx.object sixx.id="{coll_id}" sixx.name="{name}" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n',
+            '')
+
+
+def _write_io_items(out, ids, items, is_input: str, id_base: int, code_block_id: int) -> None:
+    """
+    Пишет в out входы (is_input='True') или выходы (is_input='False') блока.
+    items — кортежи (position, имя, info) в порядке вывода; id берутся из счётчика ids.
+    """
+    # Локальные имена вместо глобальных в цикле по элементам
+    write = out.write
+    write_data_type = create_sixx_data_type
+    new_uuid = _fast_uuid4_str
+    instance_coll_id = _INSTANCE_COLL_ID
+    comment_ref = _COMMENT_REF
+    for idx, (_, var_name, var_info) in enumerate(items):
+        adaptor_id, obj_id, id_source_id, type_id, name_id, uuid_obj_id, instance_id = islice(ids, 7)
+        io_uuid = new_uuid()
+
+        write(
+            f'\t\t\t<sixx.object sixx.id="{adaptor_id}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t<sixx.object sixx.id="{obj_id}" sixx.name="object" sixx.type="UniversalBlockInputOutput" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{id_source_id}" sixx.name="id" sixx.type="SmallInteger" sixx.env="Core" >{id_base + idx * 1000}</sixx.object>\n'
+            f'\t\t\t\t\t<sixx.object sixx.name="block" sixx.idref="{code_block_id}" />\n'
+        )
+        write_data_type(var_info['type'], type_id, instance_coll_id, instance_id, out)
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.name="isInput" sixx.type="{is_input}" sixx.env="Core" />\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{var_info["alias"]}</sixx.object>\n'
+            '\t\t\t\t\t<sixx.object sixx.name="isNot" sixx.type="False" sixx.env="Core" />\n'
+            f'\t\t\t\t\t<sixx.object sixx.name="nameCash" sixx.idref="{name_id}" />\n'
+            '\t\t\t\t</sixx.object>\n'
+            f'{comment_ref}'
+            f'\t\t\t\t<sixx.object sixx.id="{uuid_obj_id}" sixx.name="id" sixx.type="String" sixx.env="Core" >{io_uuid}</sixx.object>\n'
+            '\t\t\t</sixx.object>\n'
+        )
+
+
+# Кодировка .ubi: UTF-16 с BOM (как str.encode('utf-16'))
+UBI_ENCODING = 'utf-16'
 
 
 def create_ubi_xml_sixx(
@@ -53,131 +240,106 @@ def create_ubi_xml_sixx(
     setup_code: str,
     loop_code: str,
     enable_input: bool = False,
-) -> str:
-    """Создаёт SIXX XML для FLProg блока."""
+    out=None,
+):
+    """
+    Создаёт SIXX XML для FLProg блока. Документ пишется в out по мере генерации и возвращается None:
+    текстовый поток получает строки, бинарный (открытый файл 'wb') — байты в кодировке .ubi (UTF-16 с BOM).
+    Если out не передан, документ собирается в io.StringIO и возвращается строкой.
+    """
+    args = (block_name, block_description, variables, functions, global_includes, defines,
+            extra_declarations, static_declarations, setup_code, loop_code, enable_input)
+    if out is None:
+        buf = io.StringIO()
+        _write_sixx_document(buf, *args)
+        return buf.getvalue()
+    if isinstance(out, (io.RawIOBase, io.BufferedIOBase)):
+        # newline='' — без перевода \n в \r\n на Windows, байты как у xml.encode('utf-16')
+        text_out = io.TextIOWrapper(out, encoding=UBI_ENCODING, newline='')
+        try:
+            _write_sixx_document(text_out, *args)
+        finally:
+            # detach — чтобы обёртка не закрыла поток вызывающего
+            text_out.flush()
+            text_out.detach()
+        return None
+    _write_sixx_document(out, *args)
+    return None
+
+
+def _write_sixx_document(
+    out,
+    block_name: str,
+    block_description: str,
+    variables: dict,
+    functions: dict,
+    global_includes: list,
+    defines: list,
+    extra_declarations: list,
+    static_declarations: list,
+    setup_code: str,
+    loop_code: str,
+    enable_input: bool,
+) -> None:
+    """Пишет SIXX XML блока в текстовый поток out."""
+    write = out.write
     # Убираем пробелы в конце строк кода
-    setup_code = '\n'.join(line.rstrip() for line in setup_code.splitlines())
-    loop_code = '\n'.join(line.rstrip() for line in loop_code.splitlines())
+    setup_code = _strip_trailing_whitespace(setup_code)
+    loop_code = _strip_trailing_whitespace(loop_code)
     if enable_input:
         loop_code = "if(En)\n{\n" + loop_code + "\n}"
     loop_code_encoded = escape_code_for_sixx(loop_code)
     setup_code_encoded = escape_code_for_sixx(setup_code)
 
-    current_id = [0]
-
-    def next_id():
-        current_id[0] += 1
-        return current_id[0]
+    # id выдаются подряд в порядке документа; группу id одного элемента берём одним islice
+    ids = count(1)
+    next_id = ids.__next__
 
     root_id = 0
-    code_block_id = next_id()
-    main_uuid_id = next_id()
-    main_uuid = str(uuid.uuid4())
-    blocks_coll_id = next_id()
-    label_id = next_id()
-    inputs_coll_id = next_id()
-
-    instance_coll_id = 15
-    comment_str_id = 18
-
-    # Порядок входов/выходов/параметров — как в коде (по position)
-    _code_order_pos = lambda v: v.get('position', 999999999)
-
-    inputs_xml = ""
-    inputs_list = [(var_name, var_info) for var_name, var_info in variables.items() if var_info['role'] == 'input']
-    inputs_list.sort(key=lambda x: _code_order_pos(x[1]))
+    code_block_id, main_uuid_id, blocks_coll_id, label_id, inputs_coll_id = islice(ids, 5)
+    main_uuid = _fast_uuid4_str()
 
+    # Один проход по переменным: раскладываем по ролям.
+    # Входы/выходы/параметры — кортежи (position, имя, info): порядок как в коде, сортировка по position
+    inputs_list, outputs_list, vars_list, params_list = [], [], [], []
+    for var_name, var_info in variables.items():
+        role = var_info['role']
+        if role == 'input':
+            inputs_list.append((var_info.get('position', 999999999), var_name, var_info))
+        elif role == 'output':
+            outputs_list.append((var_info.get('position', 999999999), var_name, var_info))
+        elif role == 'variable':
+            vars_list.append((var_name, var_info))
+        elif role == 'parameter':
+            params_list.append((var_info.get('position', 999999999), var_name, var_info))
+    inputs_list.sort(key=_by_position)
     if enable_input:
-        en_adaptor_id = next_id()
-        en_obj_id = next_id()
-        en_id_source_id = next_id()
-        en_type_id = next_id()
-        en_name_id = next_id()
-        en_uuid_obj_id = next_id()
-        en_input_uuid = str(uuid.uuid4())
-        inputs_xml += '\t\t\t<sixx.object sixx.id="{}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'.format(en_adaptor_id)
-        inputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="object" sixx.type="UniversalBlockInputOutput" sixx.env="Arduino" >\n'.format(en_obj_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="SmallInteger" sixx.env="Core" >119328430</sixx.object>\n'.format(en_id_source_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="block" sixx.idref="{}" />\n'.format(code_block_id)
-        inputs_xml += create_sixx_data_type('boolean', en_type_id, instance_coll_id, next_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isInput" sixx.type="True" sixx.env="Core" />\n'
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >En</sixx.object>\n'.format(en_name_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isNot" sixx.type="False" sixx.env="Core" />\n'
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="nameCash" sixx.idref="{}" />\n'.format(en_name_id)
-        inputs_xml += '\t\t\t\t</sixx.object>\n'
-        inputs_xml += '\t\t\t\t<sixx.object sixx.name="comment" sixx.idref="{}" />\n'.format(comment_str_id)
-        inputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(en_uuid_obj_id, en_input_uuid)
-        inputs_xml += '\t\t\t</sixx.object>\n'
-
-    id_base = 119329430 if enable_input else 119328430
-    for idx, (var_name, var_info) in enumerate(inputs_list):
-        adaptor_id = next_id()
-        obj_id = next_id()
-        id_source_id = next_id()
-        type_id = next_id()
-        name_id = next_id()
-        uuid_obj_id = next_id()
-        input_uuid = str(uuid.uuid4())
-
-        inputs_xml += '\t\t\t<sixx.object sixx.id="{}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'.format(adaptor_id)
-        inputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="object" sixx.type="UniversalBlockInputOutput" sixx.env="Arduino" >\n'.format(obj_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="SmallInteger" sixx.env="Core" >{}</sixx.object>\n'.format(id_source_id, id_base + idx * 1000)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="block" sixx.idref="{}" />\n'.format(code_block_id)
-        inputs_xml += create_sixx_data_type(var_info['type'], type_id, instance_coll_id, next_id)
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isInput" sixx.type="True" sixx.env="Core" />\n'
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(name_id, var_info["alias"])
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isNot" sixx.type="False" sixx.env="Core" />\n'
-        inputs_xml += '\t\t\t\t\t<sixx.object sixx.name="nameCash" sixx.idref="{}" />\n'.format(name_id)
-        inputs_xml += '\t\t\t\t</sixx.object>\n'
-        inputs_xml += '\t\t\t\t<sixx.object sixx.name="comment" sixx.idref="{}" />\n'.format(comment_str_id)
-        inputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(uuid_obj_id, input_uuid)
-        inputs_xml += '\t\t\t</sixx.object>\n'
+        # Вход En (boolean) идёт первым, остальные входы нумеруются после него
+        inputs_list.insert(0, (-1, 'En', {'type': 'boolean', 'alias': 'En'}))
+
+    inputs_open, inputs_close = _collection_tags(inputs_coll_id, 'inputs', inputs_list)
+    write(
+        f'<sixx.object sixx.id="{root_id}" sixx.type="BlocksLibraryElement" sixx.env="Arduino" >\n'
+        f'\t<sixx.object sixx.id="{code_block_id}" sixx.name="typeClass" sixx.type="CodeUserBlock" sixx.env="Arduino" >\n'
+        f'\t\t<sixx.object sixx.id="{main_uuid_id}" sixx.name="id" sixx.type="String" sixx.env="Core" >{main_uuid}</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{blocks_coll_id}" sixx.name="blocks" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{label_id}" sixx.name="label" sixx.type="String" sixx.env="Core" >{block_name}</sixx.object>\n'
+        f'{inputs_open}'
+    )
+    _write_io_items(out, ids, inputs_list, 'True', 119328430, code_block_id)
 
     outputs_coll_id = next_id()
-    outputs_xml = ""
-    outputs_list = [(var_name, var_info) for var_name, var_info in variables.items() if var_info['role'] == 'output']
-    outputs_list.sort(key=lambda x: _code_order_pos(x[1]))
-
-    id_base = 153438280
-    for idx, (var_name, var_info) in enumerate(outputs_list):
-        adaptor_id = next_id()
-        obj_id = next_id()
-        id_source_id = next_id()
-        type_id = next_id()
-        name_id = next_id()
-        uuid_obj_id = next_id()
-        output_uuid = str(uuid.uuid4())
-
-        outputs_xml += '\t\t\t<sixx.object sixx.id="{}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'.format(adaptor_id)
-        outputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="object" sixx.type="UniversalBlockInputOutput" sixx.env="Arduino" >\n'.format(obj_id)
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="SmallInteger" sixx.env="Core" >{}</sixx.object>\n'.format(id_source_id, id_base + idx * 1000)
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.name="block" sixx.idref="{}" />\n'.format(code_block_id)
-        outputs_xml += create_sixx_data_type(var_info['type'], type_id, instance_coll_id, next_id)
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isInput" sixx.type="False" sixx.env="Core" />\n'
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(name_id, var_info["alias"])
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.name="isNot" sixx.type="False" sixx.env="Core" />\n'
-        outputs_xml += '\t\t\t\t\t<sixx.object sixx.name="nameCash" sixx.idref="{}" />\n'.format(name_id)
-        outputs_xml += '\t\t\t\t</sixx.object>\n'
-        outputs_xml += '\t\t\t\t<sixx.object sixx.name="comment" sixx.idref="{}" />\n'.format(comment_str_id)
-        outputs_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(uuid_obj_id, output_uuid)
-        outputs_xml += '\t\t\t</sixx.object>\n'
-
-    vars_coll_id = next_id()
-    name_str_id = next_id()
-    info_id = next_id()
-    info_str_id = next_id()
-    runs_id = next_id()
-    runs_arr_id = next_id()
-    runs_val_id = next_id()
-    values_arr_id = next_id()
-
+    outputs_list.sort(key=_by_position)
+    outputs_open, outputs_close = _collection_tags(outputs_coll_id, 'outputs', outputs_list)
+    write(
+        f'{inputs_close}'
+        f'{outputs_open}'
+    )
+    _write_io_items(out, ids, outputs_list, 'False', 153438280, code_block_id)
+
+    vars_coll_id, name_str_id, info_id, info_str_id, runs_id, runs_arr_id, runs_val_id, values_arr_id = islice(ids, 8)
     params_coll_id = next_id()
-    params_xml = ""
     # Параметры: переменные + #define с role=parameter, в порядке появления в коде
-    params_list = []
-    for var_name, var_info in variables.items():
-        if var_info['role'] == 'parameter':
-            params_list.append((_code_order_pos(var_info), var_name, var_info))
     for d in (defines or []):
         if d.get('role') == 'parameter':
             default_val_define = d.get('value')
@@ -190,20 +352,34 @@ def create_ubi_xml_sixx(
                 'alias': d['name'],
                 'default': default_val_define,
             }))
-    params_list.sort(key=lambda x: x[0])
-    params_list = [(name, info) for _, name, info in params_list]
-
-    for var_name, var_info in params_list:
-        adaptor_id = next_id()
-        param_id = next_id()
-        param_name_id = next_id()
-        param_type_id = next_id()
-        default_val_id = next_id()
-        comment_id = next_id()
-        uuid_param_id = next_id()
-        uuid_adapt_id = next_id()
-        param_uuid = str(uuid.uuid4())
-        adapt_uuid = str(uuid.uuid4())
+    params_list.sort(key=_by_position)
+    params_open, params_close = _collection_tags(params_coll_id, 'parametrs', params_list)
+
+    write(
+        f'{outputs_close}'
+        f'\t\t<sixx.object sixx.id="{vars_coll_id}" sixx.name="variables" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{name_str_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{block_name}</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{info_id}" sixx.name="info" sixx.type="Text" sixx.env="Core" >\n'
+        f'\t\t\t<sixx.object sixx.id="{info_str_id}" sixx.name="string" sixx.type="String" sixx.env="Core" >{_escape_html(block_description)}</sixx.object>\n'
+        f'\t\t\t<sixx.object sixx.id="{runs_id}" sixx.name="runs" sixx.type="RunArray" sixx.env="Core" >\n'
+        f'\t\t\t\t<sixx.object sixx.id="{runs_arr_id}" sixx.name="runs" sixx.type="Array" sixx.env="Core" >\n'
+        f'\t\t\t\t\t<sixx.object sixx.id="{runs_val_id}" sixx.type="SmallInteger" sixx.env="Core" >50</sixx.object>\n'
+        '\t\t\t\t</sixx.object>\n'
+        f'\t\t\t\t<sixx.object sixx.id="{values_arr_id}" sixx.name="values" sixx.type="Array" sixx.env="Core" >\n'
+        '\t\t\t\t\t<sixx.object sixx.type="UndefinedObject" sixx.env="Core" />\n'
+        '\t\t\t\t</sixx.object>\n'
+        '\t\t\t</sixx.object>\n'
+        '\t\t</sixx.object>\n'
+        f'{params_open}'
+    )
+
+    # Локальные имена вместо глобальных в цикле по параметрам
+    new_uuid = _fast_uuid4_str
+    instance_coll_id = _INSTANCE_COLL_ID
+    for _, var_name, var_info in params_list:
+        adaptor_id, param_id, param_name_id, param_type_id, default_val_id, comment_id, uuid_param_id, uuid_adapt_id, instance_id = islice(ids, 9)
+        param_uuid = new_uuid()
+        adapt_uuid = new_uuid()
 
         if var_info['type'] == 'String':
             default_val = var_info.get('default', '') or ''
@@ -214,110 +390,109 @@ def create_ubi_xml_sixx(
         if param_type in ('bool', 'boolean'):
             default_val = '1' if str(default_val).strip().lower() in ('true', '1') else '0'
 
-        params_xml += '\t\t\t\t<sixx.object sixx.id="{}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'.format(adaptor_id)
-        params_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="object" sixx.type="UserBlockParametr" sixx.env="Arduino" >\n'.format(param_id)
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(param_name_id, var_info["alias"])
-        params_xml += create_sixx_data_type(param_type, param_type_id, instance_coll_id, next_id)
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.name="hasDefaultValue" sixx.type="True" sixx.env="Core" />\n'
+        write(
+            f'\t\t\t\t<sixx.object sixx.id="{adaptor_id}" sixx.type="InputsOutputsAdaptorForUserBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{param_id}" sixx.name="object" sixx.type="UserBlockParametr" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{param_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{var_info["alias"]}</sixx.object>\n'
+        )
+        create_sixx_data_type(param_type, param_type_id, instance_coll_id, instance_id, out)
+        write('\t\t\t\t\t\t<sixx.object sixx.name="hasDefaultValue" sixx.type="True" sixx.env="Core" />\n')
 
         if param_type == 'String':
-            params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="stringDefaultValue" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(default_val_id, html.escape(default_val))
+            write(f'\t\t\t\t\t\t<sixx.object sixx.id="{default_val_id}" sixx.name="stringDefaultValue" sixx.type="String" sixx.env="Core" >{_escape_html(default_val)}</sixx.object>\n')
         else:
             try:
                 if param_type in ('float', 'double'):
-                    params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="numberDefaultValue" sixx.type="Float" sixx.env="Core" >{}</sixx.object>\n'.format(default_val_id, default_val)
+                    write(f'\t\t\t\t\t\t<sixx.object sixx.id="{default_val_id}" sixx.name="numberDefaultValue" sixx.type="Float" sixx.env="Core" >{default_val}</sixx.object>\n')
                 else:
-                    params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="numberDefaultValue" sixx.type="SmallInteger" sixx.env="Core" >{}</sixx.object>\n'.format(default_val_id, default_val)
+                    write(f'\t\t\t\t\t\t<sixx.object sixx.id="{default_val_id}" sixx.name="numberDefaultValue" sixx.type="SmallInteger" sixx.env="Core" >{default_val}</sixx.object>\n')
             except Exception:
-                params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="numberDefaultValue" sixx.type="SmallInteger" sixx.env="Core" >0</sixx.object>\n'.format(default_val_id)
-
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.name="hasUpRange" sixx.type="False" sixx.env="Core" />\n'
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.name="hasDownRange" sixx.type="False" sixx.env="Core" />\n'
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="comment" sixx.type="String" sixx.env="Core" ></sixx.object>\n'.format(comment_id)
-        params_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(uuid_param_id, param_uuid)
-        params_xml += '\t\t\t\t\t</sixx.object>\n'
-        params_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(uuid_adapt_id, adapt_uuid)
-        params_xml += '\t\t\t\t</sixx.object>\n'
-
-    loop_part_id = next_id()
-    loop_code_id = next_id()
-
-    setup_part_id = next_id()
-    setup_code_id = next_id()
-
-    declare_part_id = next_id()
-    declare_coll_id = next_id()
-    declare_xml = ""
-    vars_list = [(var_name, var_info) for var_name, var_info in variables.items() if var_info['role'] == 'variable']
+                write(f'\t\t\t\t\t\t<sixx.object sixx.id="{default_val_id}" sixx.name="numberDefaultValue" sixx.type="SmallInteger" sixx.env="Core" >0</sixx.object>\n')
+
+        write(
+            '\t\t\t\t\t\t<sixx.object sixx.name="hasUpRange" sixx.type="False" sixx.env="Core" />\n'
+            '\t\t\t\t\t\t<sixx.object sixx.name="hasDownRange" sixx.type="False" sixx.env="Core" />\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{comment_id}" sixx.name="comment" sixx.type="String" sixx.env="Core" ></sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{uuid_param_id}" sixx.name="id" sixx.type="String" sixx.env="Core" >{param_uuid}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{uuid_adapt_id}" sixx.name="id" sixx.type="String" sixx.env="Core" >{adapt_uuid}</sixx.object>\n'
+            '\t\t\t\t</sixx.object>\n'
+        )
+
+    loop_part_id, loop_code_id, setup_part_id, setup_code_id, declare_part_id, declare_coll_id = islice(ids, 6)
+    write(
+        f'{params_close}'
+        f'\t\t<sixx.object sixx.id="{loop_part_id}" sixx.name="loopCodePart" sixx.type="CodeUserBlockLoopCodePart" sixx.env="Arduino" >\n'
+        f'\t\t\t<sixx.object sixx.id="{loop_code_id}" sixx.name="code" sixx.type="String" sixx.env="Core" >{loop_code_encoded}</sixx.object>\n'
+        '\t\t</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{setup_part_id}" sixx.name="setupCodePart" sixx.type="CodeUserBlockSetupCodePart" sixx.env="Arduino" >\n'
+        f'\t\t\t<sixx.object sixx.id="{setup_code_id}" sixx.name="code" sixx.type="String" sixx.env="Core" >{setup_code_encoded}</sixx.object>\n'
+        '\t\t</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{declare_part_id}" sixx.name="declareCodePart" sixx.type="CodeUserBlockDeclareCodePart" sixx.env="Arduino" >\n'
+        f'\t\t\t<sixx.object sixx.id="{declare_coll_id}" sixx.name="code" sixx.type="OrderedCollection" sixx.env="Core" >\n'
+    )
 
     # #include — как в FLProg: CodeUserBlockDeclareDefineBlock (define="#include", name="<...>")
     for inc in global_includes:
-        line = (inc or '').strip().rstrip()
+        line = (inc or '').strip()
         if not line.startswith('#include'):
             continue
-        rest = line[8:].strip().rstrip()
-        decl_id = next_id()
-        define_id = next_id()
-        name_id = next_id()
-        declare_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockDeclareDefineBlock" sixx.env="Arduino" >\n'.format(decl_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="define" sixx.type="String" sixx.env="Core" >&#35;include</sixx.object>\n'.format(define_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(name_id, html.escape(rest))
-        declare_xml += '\t\t\t\t\t</sixx.object>\n'
+        rest = line[8:].strip()
+        decl_id, define_id, name_id = islice(ids, 3)
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{decl_id}" sixx.type="CodeUserBlockDeclareDefineBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{define_id}" sixx.name="define" sixx.type="String" sixx.env="Core" >&#35;include</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{_escape_html(rest)}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
 
     # #define (не parameter) — CodeUserBlockDeclareDefineBlock (define="#define", name, lastPart)
     for d in (defines or []):
         if d.get('role') == 'parameter':
             continue
-        decl_id = next_id()
-        define_id = next_id()
-        name_id = next_id()
-        last_part_id = next_id()
-        d_name = (str(d.get('name', '')).strip().rstrip())
-        d_value = (str(d.get('value', '')).strip().rstrip())
-        declare_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockDeclareDefineBlock" sixx.env="Arduino" >\n'.format(decl_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="define" sixx.type="String" sixx.env="Core" >&#35;define</sixx.object>\n'.format(define_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(name_id, html.escape(d_name))
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(last_part_id, html.escape(d_value))
-        declare_xml += '\t\t\t\t\t</sixx.object>\n'
+        decl_id, define_id, name_id, last_part_id = islice(ids, 4)
+        d_name = str(d.get('name', '')).strip()
+        d_value = str(d.get('value', '')).strip()
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{decl_id}" sixx.type="CodeUserBlockDeclareDefineBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{define_id}" sixx.name="define" sixx.type="String" sixx.env="Core" >&#35;define</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{_escape_html(d_name)}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{last_part_id}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{_escape_html(d_value)}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
 
     # static-переменные (из global, в GUI не редактируются) — CodeUserBlockDeclareStandartBlock: firstPart="static type", name, lastPart
     for line in (static_declarations or []):
-        line = (line or '').strip().rstrip()
+        line = (line or '').strip()
         if not line.endswith(';'):
             continue
         stmt = line[:-1].strip()
-        if not re.match(r'^\s*static\s+', stmt):
-            continue
-        m = re.match(r'^\s*static\s+(.+?)\s+([a-zA-Z_][A-Za-z0-9_]*)\s*(.*)$', stmt, re.DOTALL)
+        m = _STATIC_PARSE_RE.match(stmt)
         if not m:
             continue
         first_part = "static " + m.group(1).strip()
         name_part = m.group(2)
         rest = m.group(3).strip()
         if rest.startswith('='):
-            last_part = "= {};".format(escape_code_for_sixx(rest[1:].strip()))
+            last_part = f"= {escape_code_for_sixx(rest[1:].strip())};"
         else:
             last_part = ";"
-        decl_id = next_id()
-        decl_name_id = next_id()
-        decl_last_id = next_id()
-        decl_first_id = next_id()
-        declare_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'.format(decl_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_name_id, html.escape(name_part))
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_last_id, last_part)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_first_id, html.escape(first_part))
-        declare_xml += '\t\t\t\t\t</sixx.object>\n'
+        decl_id, decl_name_id, decl_last_id, decl_first_id = islice(ids, 4)
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{decl_id}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{_escape_html(name_part)}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_last_id}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{last_part}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_first_id}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{_escape_html(first_part)}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
 
     # Остальные объявления (extra) — CodeUserBlockDeclareStandartBlock, порядок как в FLProg: name, lastPart, firstPart
     for line in extra_declarations:
-        line = (line or '').strip().rstrip()
+        line = (line or '').strip()
         if not line.endswith(';'):
             continue
         stmt = line[:-1].strip()
-        decl_id = next_id()
-        decl_name_id = next_id()
-        decl_last_id = next_id()
-        decl_first_id = next_id()
+        decl_id, decl_name_id, decl_last_id, decl_first_id = islice(ids, 4)
         # "SoftwareSerial newSerial = SoftwareSerial(7, 8)" -> firstPart=SoftwareSerial, name=newSerial, lastPart="= SoftwareSerial(7, 8);"
         parts = stmt.split(None, 2)
         if len(parts) >= 2:
@@ -325,129 +500,121 @@ def create_ubi_xml_sixx(
             name_part = parts[1]
             last_part_raw = parts[2] if len(parts) > 2 else ""
             if last_part_raw.startswith('='):
-                last_part = "= {};".format(escape_code_for_sixx(last_part_raw[1:].strip()))
+                last_part = f"= {escape_code_for_sixx(last_part_raw[1:].strip())};"
             else:
-                last_part = "= {};".format(escape_code_for_sixx(last_part_raw)) if last_part_raw else ";"
+                last_part = f"= {escape_code_for_sixx(last_part_raw)};" if last_part_raw else ";"
         else:
             first_part = parts[0] if parts else ""
             name_part = ""
             last_part = ";"
-        declare_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'.format(decl_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_name_id, html.escape(name_part))
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_last_id, last_part)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_first_id, html.escape(first_part))
-        declare_xml += '\t\t\t\t\t</sixx.object>\n'
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{decl_id}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{_escape_html(name_part)}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_last_id}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{last_part}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_first_id}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{_escape_html(first_part)}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
 
     for var_name, var_info in vars_list:
-        decl_id = next_id()
-        decl_name_id = next_id()
-        decl_last_id = next_id()
-        decl_first_id = next_id()
+        decl_id, decl_name_id, decl_last_id, decl_first_id = islice(ids, 4)
 
         default_val = var_info.get('default')
         if default_val:
-            last_part = "= {};".format(escape_code_for_sixx(str(default_val).strip().rstrip()))
+            last_part = f"= {escape_code_for_sixx(str(default_val).strip())};"
         else:
             last_part = ";"
 
-        declare_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'.format(decl_id)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_name_id, (var_info.get("alias") or "").strip().rstrip())
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_last_id, last_part)
-        declare_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(decl_first_id, (var_info.get("type") or "").strip().rstrip())
-        declare_xml += '\t\t\t\t\t</sixx.object>\n'
-
-    func_part_id = next_id()
-    func_coll_id = next_id()
-    functions_xml = ""
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{decl_id}" sixx.type="CodeUserBlockDeclareStandartBlock" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{(var_info.get("alias") or "").strip()}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_last_id}" sixx.name="lastPart" sixx.type="String" sixx.env="Core" >{last_part}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{decl_first_id}" sixx.name="firstPart" sixx.type="String" sixx.env="Core" >{(var_info.get("type") or "").strip()}</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
+
+    func_part_id, func_coll_id = islice(ids, 2)
+    write(
+        '\t\t\t</sixx.object>\n'
+        '\t\t</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{func_part_id}" sixx.name="functionCodePart" sixx.type="CodeUserBlockFunctuinCodePart" sixx.env="Arduino" >\n'
+        f'\t\t\t<sixx.object sixx.id="{func_coll_id}" sixx.name="code" sixx.type="OrderedCollection" sixx.env="Core" >\n'
+    )
 
     for func_name, func_info in functions.items():
-        func_id = next_id()
-        func_body_id = next_id()
-        func_proto_id = next_id()
-        func_ret_type_id = next_id()
-        func_name_id = next_id()
-        func_params_coll_id = next_id()
-
-        body_encoded = escape_code_for_sixx('\n'.join(line.rstrip() for line in func_info['body'].splitlines()))
-
-        functions_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockFunction" sixx.env="Arduino" >\n'.format(func_id)
-        functions_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="functionBody" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(func_body_id, body_encoded)
-        functions_xml += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="parsesFunctionName" sixx.type="CodeUserBlockFunctionName" sixx.env="Arduino" >\n'.format(func_proto_id)
-        functions_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="declare" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(func_ret_type_id, func_info["return_type"])
-        functions_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(func_name_id, func_name)
-        functions_xml += '\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="parametrs" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(func_params_coll_id)
+        func_id, func_body_id, func_proto_id, func_ret_type_id, func_name_id, func_params_coll_id = islice(ids, 6)
+
+        body_encoded = escape_code_for_sixx(_strip_trailing_whitespace(func_info['body']))
+
+        write(
+            f'\t\t\t\t\t<sixx.object sixx.id="{func_id}" sixx.type="CodeUserBlockFunction" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{func_body_id}" sixx.name="functionBody" sixx.type="String" sixx.env="Core" >{body_encoded}</sixx.object>\n'
+            f'\t\t\t\t\t<sixx.object sixx.id="{func_proto_id}" sixx.name="parsesFunctionName" sixx.type="CodeUserBlockFunctionName" sixx.env="Arduino" >\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{func_ret_type_id}" sixx.name="declare" sixx.type="String" sixx.env="Core" >{_escape_html(func_info["return_type"])}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{func_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{func_name}</sixx.object>\n'
+            f'\t\t\t\t\t\t<sixx.object sixx.id="{func_params_coll_id}" sixx.name="parametrs" sixx.type="OrderedCollection" sixx.env="Core" >\n'
+        )
 
         for param in func_info.get('parsed_params', []):
-            fparam_id = next_id()
-            fparam_type_id = next_id()
-            fparam_name_id = next_id()
+            fparam_id, fparam_type_id, fparam_name_id = islice(ids, 3)
 
-            functions_xml += '\t\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="CodeUserBlockFunctionParametr" sixx.env="Arduino" >\n'.format(fparam_id)
-            functions_xml += '\t\t\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="declare" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(fparam_type_id, param["type"])
-            functions_xml += '\t\t\t\t\t\t\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(fparam_name_id, param["name"])
-            functions_xml += '\t\t\t\t\t\t\t</sixx.object>\n'
+            write(
+                f'\t\t\t\t\t\t\t<sixx.object sixx.id="{fparam_id}" sixx.type="CodeUserBlockFunctionParametr" sixx.env="Arduino" >\n'
+                f'\t\t\t\t\t\t\t\t<sixx.object sixx.id="{fparam_type_id}" sixx.name="declare" sixx.type="String" sixx.env="Core" >{_escape_html(param["type"])}</sixx.object>\n'
+                f'\t\t\t\t\t\t\t\t<sixx.object sixx.id="{fparam_name_id}" sixx.name="name" sixx.type="String" sixx.env="Core" >{_escape_html(param["name"])}</sixx.object>\n'
+                '\t\t\t\t\t\t\t</sixx.object>\n'
+            )
 
-        functions_xml += '\t\t\t\t\t\t</sixx.object>\n'
-        functions_xml += '\t\t\t\t\t</sixx.object>\n'
-        functions_xml += '\t\t\t\t\t</sixx.object>\n'
+        write(
+            '\t\t\t\t\t\t</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+            '\t\t\t\t\t</sixx.object>\n'
+        )
 
     libs_id = next_id()
-
-    xml_header = '<sixx.object sixx.id="{}" sixx.type="BlocksLibraryElement" sixx.env="Arduino" >\n'.format(root_id)
-    xml_header += '\t<sixx.object sixx.id="{}" sixx.name="typeClass" sixx.type="CodeUserBlock" sixx.env="Arduino" >\n'.format(code_block_id)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="id" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(main_uuid_id, main_uuid)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="blocks" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(blocks_coll_id)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="label" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(label_id, block_name)
-    if inputs_xml:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="inputs" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(inputs_coll_id)
-        xml_header += inputs_xml
-        xml_header += '\t\t</sixx.object>\n'
-    else:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="inputs" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(inputs_coll_id)
-    if outputs_xml:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="outputs" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(outputs_coll_id)
-        xml_header += outputs_xml
-        xml_header += '\t\t</sixx.object>\n'
-    else:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="outputs" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(outputs_coll_id)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="variables" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(vars_coll_id)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="name" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(name_str_id, block_name)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="info" sixx.type="Text" sixx.env="Core" >\n'.format(info_id)
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="string" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(info_str_id, html.escape(block_description))
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="runs" sixx.type="RunArray" sixx.env="Core" >\n'.format(runs_id)
-    xml_header += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="runs" sixx.type="Array" sixx.env="Core" >\n'.format(runs_arr_id)
-    xml_header += '\t\t\t\t\t<sixx.object sixx.id="{}" sixx.type="SmallInteger" sixx.env="Core" >50</sixx.object>\n'.format(runs_val_id)
-    xml_header += '\t\t\t\t</sixx.object>\n'
-    xml_header += '\t\t\t\t<sixx.object sixx.id="{}" sixx.name="values" sixx.type="Array" sixx.env="Core" >\n'.format(values_arr_id)
-    xml_header += '\t\t\t\t\t<sixx.object sixx.type="UndefinedObject" sixx.env="Core" />\n'
-    xml_header += '\t\t\t\t</sixx.object>\n'
-    xml_header += '\t\t\t</sixx.object>\n'
-    xml_header += '\t\t</sixx.object>\n'
-    if params_xml:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="parametrs" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(params_coll_id)
-        xml_header += params_xml
-        xml_header += '\t\t</sixx.object>\n'
-    else:
-        xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="parametrs" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(params_coll_id)
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="loopCodePart" sixx.type="CodeUserBlockLoopCodePart" sixx.env="Arduino" >\n'.format(loop_part_id)
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="code" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(loop_code_id, loop_code_encoded)
-    xml_header += '\t\t</sixx.object>\n'
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="setupCodePart" sixx.type="CodeUserBlockSetupCodePart" sixx.env="Arduino" >\n'.format(setup_part_id)
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="code" sixx.type="String" sixx.env="Core" >{}</sixx.object>\n'.format(setup_code_id, setup_code_encoded)
-    xml_header += '\t\t</sixx.object>\n'
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="declareCodePart" sixx.type="CodeUserBlockDeclareCodePart" sixx.env="Arduino" >\n'.format(declare_part_id)
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="code" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(declare_coll_id)
-    xml_header += declare_xml
-    xml_header += '\t\t\t</sixx.object>\n'
-    xml_header += '\t\t</sixx.object>\n'
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="functionCodePart" sixx.type="CodeUserBlockFunctuinCodePart" sixx.env="Arduino" >\n'.format(func_part_id)
-    xml_header += '\t\t\t<sixx.object sixx.id="{}" sixx.name="code" sixx.type="OrderedCollection" sixx.env="Core" >\n'.format(func_coll_id)
-    xml_header += functions_xml
-    xml_header += '\t\t\t</sixx.object>\n'
-    xml_header += '\t\t</sixx.object>\n'
-    xml_header += '\t\t<sixx.object sixx.id="{}" sixx.name="userLibraries" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'.format(libs_id)
-    xml_header += '\t\t<sixx.object sixx.name="notCanManyUse" sixx.type="False" sixx.env="Core" />\n'
-    xml_header += '\t</sixx.object>\n'
-    xml_header += '</sixx.object>\n'
-
-    return xml_header
+    write(
+        '\t\t\t</sixx.object>\n'
+        '\t\t</sixx.object>\n'
+        f'\t\t<sixx.object sixx.id="{libs_id}" sixx.name="userLibraries" sixx.type="OrderedCollection" sixx.env="Core" ></sixx.object>\n'
+        '\t\t<sixx.object sixx.name="notCanManyUse" sixx.type="False" sixx.env="Core" />\n'
+        '\t</sixx.object>\n'
+        '</sixx.object>\n'
+    )
+
+
+def _current_umask() -> int:
+    """Текущая umask процесса (os.umask её только устанавливает — ставим и сразу возвращаем прежнюю)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def write_ubi_file(filename: str, xml_content) -> None:
+    """
+    Записывает .ubi в UTF-16 (с BOM). xml_content — готовая строка SIXX или функция, которая пишет документ
+    в переданный бинарный поток (например, lambda f: create_ubi_xml_sixx(..., out=f)) — тогда он кодируется
+    по мере генерации, без промежуточной строки. Запись идёт во временный файл в той же папке,
+    который подменяет целевой (os.replace) только после успешной записи — при сбое прежний .ubi не портится.
+    """
+    data = None if callable(xml_content) else xml_content.encode(UBI_ENCODING)
+    target_dir = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.ubi-', suffix='.tmp', dir=target_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if data is None:
+                xml_content(f)
+            else:
+                f.write(data)
+        # mkstemp создаёт файл с правами 0600 — оставляем права существующего файла,
+        # а новому даём те же, что дал бы open(..., 'w'): 0666 с учётом umask
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_current_umask()
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
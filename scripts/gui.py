@@ -14,11 +14,11 @@ import urllib.request
 
 from PyQt5 import QtWidgets, QtCore, QtGui
 
-from constants import VERSION, GITHUB_REPO, DEFINE_TYPE_CHOICES
+from constants import VERSION, GITHUB_REPO, DEFINE_TYPE_CHOICES, DEFAULT_BLOCK_DESCRIPTION
 
 log = logging.getLogger(__name__)
 from parser import parse_arduino_code, extract_function_body
-from generator import create_ubi_xml_sixx
+from generator import create_ubi_xml_sixx, make_identifier_renamer, write_ubi_file
 
 
 def _parse_version(v):
@@ -110,11 +110,70 @@ def _project_root():
     return parent if os.path.basename(script_dir).lower() == "scripts" else script_dir
 
 
+class ColumnsTableModel(QtCore.QAbstractTableModel):
+    """
+    Табличная модель для QTreeView: данные хранятся по колонкам (отдельный список на колонку),
+    без объекта-элемента на каждую ячейку. UserRole строки — произвольная метка (tag).
+    """
+
+    def __init__(self, headers, parent=None):
+        super().__init__(parent)
+        self._headers = list(headers)
+        self._columns = [[] for _ in self._headers]
+        self._tags = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._tags)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._headers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self._columns[index.column()][index.row()]
+        if role == QtCore.Qt.UserRole:
+            return self._tags[index.row()]
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self._headers[section]
+        return None
+
+    def set_columns(self, columns, tags):
+        """Заменяет все данные: columns — списки значений по колонкам, tags — метки строк."""
+        self.beginResetModel()
+        self._columns = [list(column) for column in columns]
+        self._tags = list(tags)
+        self.endResetModel()
+
+    def clear(self):
+        self.set_columns([[] for _ in self._headers], [])
+
+    def value(self, row, column):
+        return self._columns[column][row]
+
+    def tag(self, row):
+        return self._tags[row]
+
+    def set_row(self, row, values):
+        """Обновляет строку row: values — словарь {колонка: значение}."""
+        for column, value in values.items():
+            self._columns[column][row] = value
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._headers) - 1))
+
+
 class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
     """
     Главный класс приложения для конвертации Arduino кода в блоки FLProg.
     """
 
+    # Общие для всех окон шрифт справки и иконка; создаются при первом использовании (нужен QApplication)
+    _HELP_FONT = None
+    _WINDOW_ICON = None
+
     def __init__(self):
         log.debug("ArduinoToFLProgConverter.__init__: start")
         super().__init__()
@@ -128,6 +187,12 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         self.defines = []  # список {name, value, role}: #define как переменные с ролями global | parameter
         self.extra_declarations = []
         self.static_declarations = []  # static-переменные из global, в GUI не показываются, передаются в генератор
+        self._setup_code = ""
+        self._loop_code = ""
+        self._parsed_revision = None  # revision() документа кода на момент последнего парсинга
+        self._renames = {}  # имя переменной -> псевдоним (только изменённые)
+        self._alias_renamer = None  # собирается лениво в _build_xml_content, пересобирается при смене _renames
+        self._message_boxes = {}  # QMessageBox по значку, создаются при первом показе и переиспользуются
         self._safe_home = self._get_safe_home_dir()
         app_dir = self._app_dir()
         self.last_save_dir = app_dir if (app_dir and os.path.isdir(app_dir)) else self._safe_home
@@ -142,8 +207,8 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         """Запуск проверки обновлений в фоновом потоке (urllib + ssl без проверки сертификата)."""
         log.info("_start_update_check: silent=%s", silent)
         if not getattr(sys, "frozen", False) and not silent:
-            QtWidgets.QMessageBox.information(
-                self, "Проверка обновлений",
+            self._show_info(
+                "Проверка обновлений",
                 "Проверка доступна только при запуске из exe-файла."
             )
             return
@@ -183,8 +248,8 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
                 if ans == QtWidgets.QMessageBox.Yes and download_url:
                     QtGui.QDesktopServices.openUrl(QtCore.QUrl(download_url))
             elif not silent:
-                QtWidgets.QMessageBox.information(
-                    self, "Обновления", "Установлена актуальная версия ({}).".format(VERSION)
+                self._show_info(
+                    "Обновления", "Установлена актуальная версия ({}).".format(VERSION)
                 )
 
         def on_error(err_msg):
@@ -194,8 +259,8 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
                 self._update_progress = None
             thread.quit()
             if not silent:
-                QtWidgets.QMessageBox.warning(
-                    self, "Ошибка проверки обновлений",
+                self._show_warning(
+                    "Ошибка проверки обновлений",
                     "Не удалось получить данные:\n{}".format(err_msg)
                 )
 
@@ -204,6 +269,31 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         worker.error.connect(on_error)
         thread.start()
 
+    def _show_message(self, icon, title, text, parent=None):
+        """
+        Показывает модальное сообщение; на каждый значок создаётся один QMessageBox, далее он переиспользуется.
+        parent — окно, над которым показать сообщение (например, открытый диалог); такой QMessageBox не кэшируется.
+        """
+        box = self._message_boxes.get(icon) if parent is None else None
+        if box is None:
+            box = QtWidgets.QMessageBox(parent or self)
+            box.setIcon(icon)
+            box.setStandardButtons(QtWidgets.QMessageBox.Ok)
+            if parent is None:
+                self._message_boxes[icon] = box
+        box.setWindowTitle(title)
+        box.setText(text)
+        box.exec_()
+
+    def _show_info(self, title, text):
+        self._show_message(QtWidgets.QMessageBox.Information, title, text)
+
+    def _show_warning(self, title, text, parent=None):
+        self._show_message(QtWidgets.QMessageBox.Warning, title, text, parent)
+
+    def _show_error(self, title, text):
+        self._show_message(QtWidgets.QMessageBox.Critical, title, text)
+
     def _app_dir(self):
         """Папка, в которой находится ino2ubi (exe или скрипты)."""
         if getattr(sys, "frozen", False):
@@ -232,16 +322,18 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
 
     def _set_window_icon(self):
         """Устанавливает иконку окна из icon.ico (в каталоге скриптов или в корне проекта)."""
-        base_dir = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
-        icon_path = os.path.join(base_dir, "icon.ico")
-        if not os.path.isfile(icon_path):
-            icon_path = os.path.join(_project_root(), "icon.ico")
-        if os.path.isfile(icon_path):
-            self.setWindowIcon(QtGui.QIcon(icon_path))
-        else:
-            icon = QtWidgets.QApplication.style().standardIcon(QtWidgets.QStyle.SP_FileDialogContentsView)
-            if not icon.isNull():
-                self.setWindowIcon(icon)
+        cls = ArduinoToFLProgConverter
+        if cls._WINDOW_ICON is None:
+            base_dir = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+            icon_path = os.path.join(base_dir, "icon.ico")
+            if not os.path.isfile(icon_path):
+                icon_path = os.path.join(_project_root(), "icon.ico")
+            if os.path.isfile(icon_path):
+                cls._WINDOW_ICON = QtGui.QIcon(icon_path)
+            else:
+                cls._WINDOW_ICON = QtWidgets.QApplication.style().standardIcon(QtWidgets.QStyle.SP_FileDialogContentsView)
+        if not cls._WINDOW_ICON.isNull():
+            self.setWindowIcon(cls._WINDOW_ICON)
 
     def create_widgets(self):
         central_widget = QtWidgets.QWidget()
@@ -295,14 +387,17 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         var_layout = QtWidgets.QVBoxLayout(var_tab)
         var_layout.addWidget(QtWidgets.QLabel("Найденные переменные (двойной клик для редактирования):"))
 
-        self.var_tree = QtWidgets.QTreeWidget()
-        self.var_tree.setHeaderLabels(["Переменная", "Тип", "Роль", "Псевдоним", "По умолчанию"])
+        self.var_model = ColumnsTableModel(["Переменная", "Тип", "Роль", "Псевдоним", "По умолчанию"], self)
+        self.var_tree = QtWidgets.QTreeView()
+        self.var_tree.setRootIsDecorated(False)
+        self.var_tree.setUniformRowHeights(True)
+        self.var_tree.setModel(self.var_model)
         self.var_tree.setColumnWidth(0, 120)
         self.var_tree.setColumnWidth(1, 100)
         self.var_tree.setColumnWidth(2, 100)
         self.var_tree.setColumnWidth(3, 120)
         self.var_tree.setColumnWidth(4, 100)
-        self.var_tree.itemDoubleClicked.connect(self.on_tree_double_click)
+        self.var_tree.doubleClicked.connect(self.on_tree_double_click)
         var_layout.addWidget(self.var_tree)
 
         self.tabs.addTab(var_tab, "Переменные")
@@ -311,13 +406,16 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         func_layout = QtWidgets.QVBoxLayout(func_tab)
         func_layout.addWidget(QtWidgets.QLabel("Найденные функции (двойной клик для редактирования):"))
 
-        self.func_tree = QtWidgets.QTreeWidget()
-        self.func_tree.setHeaderLabels(["Имя функции", "Возвращает", "Параметры", "Тело функции"])
+        self.func_model = ColumnsTableModel(["Имя функции", "Возвращает", "Параметры", "Тело функции"], self)
+        self.func_tree = QtWidgets.QTreeView()
+        self.func_tree.setRootIsDecorated(False)
+        self.func_tree.setUniformRowHeights(True)
+        self.func_tree.setModel(self.func_model)
         self.func_tree.setColumnWidth(0, 120)
         self.func_tree.setColumnWidth(1, 80)
         self.func_tree.setColumnWidth(2, 150)
         self.func_tree.setColumnWidth(3, 300)
-        self.func_tree.itemDoubleClicked.connect(self.edit_function)
+        self.func_tree.doubleClicked.connect(self.edit_function)
         func_layout.addWidget(self.func_tree)
 
         self.tabs.addTab(func_tab, "Функции")
@@ -333,7 +431,7 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
 
         settings_layout.addWidget(QtWidgets.QLabel("Описание блока:"), 1, 0)
         self.block_description_entry = QtWidgets.QTextEdit()
-        self.block_description_entry.setPlainText("Автоматически сгенерированный блок")
+        self.block_description_entry.setPlainText(DEFAULT_BLOCK_DESCRIPTION)
         self.block_description_entry.setFixedHeight(80)
         settings_layout.addWidget(self.block_description_entry, 1, 1)
 
@@ -412,7 +510,9 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             text.setMarkdown(help_text)
         except AttributeError:
             text.setPlainText(help_text)
-        text.setFont(QtGui.QFont("Consolas", 9))
+        if ArduinoToFLProgConverter._HELP_FONT is None:
+            ArduinoToFLProgConverter._HELP_FONT = QtGui.QFont("Consolas", 9)
+        text.setFont(ArduinoToFLProgConverter._HELP_FONT)
         layout.addWidget(text)
         btn_close = QtWidgets.QPushButton("Закрыть")
         btn_close.clicked.connect(dialog.accept)
@@ -457,21 +557,23 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
                 log.info("load_arduino_file: loaded %s", filename)
             except Exception as e:
                 log.exception("load_arduino_file: error %s", e)
-                QtWidgets.QMessageBox.critical(self, "Ошибка", "Не удалось загрузить файл: {}".format(e))
+                self._show_error("Ошибка", "Не удалось загрузить файл: {}".format(e))
 
     def parse_code(self):
         """Парсит Arduino код и обновляет таблицы."""
         log.debug("parse_code: start")
         code = self.code_input.toPlainText()
-        self.var_tree.clear()
+        self.var_model.clear()
         self.variables = {}
-        self.func_tree.clear()
+        self.func_model.clear()
         self.functions = {}
         self.global_section_raw = ""
         self.global_includes = []
         self.defines = []
         self.extra_declarations = []
         self.static_declarations = []
+        self._parsed_revision = None
+        self._alias_renamer = None
 
         result = parse_arduino_code(code)
         log.debug("parse_code: parse_arduino_code done")
@@ -479,6 +581,7 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         if result['leading_comment']:
             self.block_description_entry.setPlainText(result['leading_comment'])
 
+        # parse_arduino_code возвращает собственную копию результата — её можно изменять
         self.variables = result['variables']
         self.functions = result['functions']
         self.global_section_raw = result['global_section_raw']
@@ -486,33 +589,39 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         self.defines = result.get('defines', [])
         self.extra_declarations = result['extra_declarations']
         self.static_declarations = result.get('static_declarations', [])
+        self._setup_code = result['setup_body']
+        self._loop_code = result['loop_body']
+        self._parsed_revision = self.code_input.document().revision()
 
+        func_names, return_types, params_list, body_previews = [], [], [], []
         for func_name, func_info in self.functions.items():
-            params_display = func_info['params'] if func_info['params'] else "(нет)"
-            body_preview = func_info['body'][:50] + "..." if len(func_info['body']) > 50 else func_info['body']
-            item = QtWidgets.QTreeWidgetItem([func_name, func_info['return_type'], params_display, body_preview])
-            self.func_tree.addTopLevelItem(item)
-
+            func_names.append(func_name)
+            return_types.append(func_info['return_type'])
+            params_list.append(func_info['params'] if func_info['params'] else "(нет)")
+            body_previews.append(func_info['body'][:50] + "..." if len(func_info['body']) > 50 else func_info['body'])
+        self.func_model.set_columns((func_names, return_types, params_list, body_previews), [None] * len(func_names))
+
+        # Строки переменных (tag None), затем #define (tag — индекс в self.defines)
+        names, types, roles, aliases, defaults, tags = [], [], [], [], [], []
         for var_name, var_info in self.variables.items():
-            default_display = var_info.get('default') or ""
-            item = QtWidgets.QTreeWidgetItem([
-                var_name, var_info['type'], var_info['role'], var_info['alias'], default_display
-            ])
-            self.var_tree.addTopLevelItem(item)
-
-        for d in self.defines:
+            names.append(var_name)
+            types.append(var_info['type'])
+            roles.append(var_info['role'])
+            aliases.append(var_info['alias'])
+            defaults.append(var_info.get('default') or "")
+            tags.append(None)
+
+        for define_index, d in enumerate(self.defines):
             name = d.get('name', '')
-            value = d.get('value', '')
-            role = d.get('role', 'global')
-            define_type = d.get('type', 'String')
-            item = QtWidgets.QTreeWidgetItem([
-                name, define_type, role, name, value
-            ])
-            item.setData(0, QtCore.Qt.UserRole, "define")
-            self.var_tree.addTopLevelItem(item)
-
-        QtWidgets.QMessageBox.information(
-            self,
+            names.append(name)
+            types.append(d.get('type', 'String'))
+            roles.append(d.get('role', 'global'))
+            aliases.append(name)
+            defaults.append(d.get('value', ''))
+            tags.append(define_index)
+        self.var_model.set_columns((names, types, roles, aliases, defaults), tags)
+
+        self._show_info(
             "Парсинг",
             "Найдено глобальных переменных: {}\nНайдено функций: {}\nНайдено #include: {}\nНайдено #define: {}".format(
                 len(self.variables),
@@ -522,8 +631,9 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             ),
         )
 
-    def edit_function(self, item, column):
-        func_name = item.text(0)
+    def edit_function(self, index):
+        row = index.row()
+        func_name = self.func_model.value(row, 0)
         func_info = self.functions[func_name]
 
         dialog = QtWidgets.QDialog(self)
@@ -544,7 +654,7 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             new_body = body_text.toPlainText().strip()
             self.functions[func_name]['body'] = new_body
             body_preview = new_body[:50] + "..." if len(new_body) > 50 else new_body
-            item.setText(3, body_preview)
+            self.func_model.set_row(row, {3: body_preview})
             dialog.accept()
 
         btn_save = QtWidgets.QPushButton("Сохранить")
@@ -554,7 +664,7 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def _edit_define(self, item, define_index):
+    def _edit_define(self, row, define_index):
         """Открывает диалог редактирования #define (роль, тип, значение по умолчанию)."""
         if define_index < 0 or define_index >= len(self.defines):
             return
@@ -613,21 +723,18 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             new_type = type_combo.currentText()
             new_role = role_combo.currentText()
             if not new_name:
-                QtWidgets.QMessageBox.warning(dialog, "Ошибка", "Имя не может быть пустым!")
+                self._show_warning("Ошибка", "Имя не может быть пустым!", dialog)
                 return
             if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', new_name):
-                QtWidgets.QMessageBox.warning(
-                    dialog, "Ошибка",
+                self._show_warning(
+                    "Ошибка",
                     "Имя должно начинаться с буквы или подчёркивания\n"
-                    "и содержать только буквы, цифры и подчёркивания!"
+                    "и содержать только буквы, цифры и подчёркивания!",
+                    dialog
                 )
                 return
             self.defines[define_index] = {'name': new_name, 'value': new_value, 'role': new_role, 'type': new_type}
-            item.setText(0, new_name)
-            item.setText(1, new_type)
-            item.setText(2, new_role)
-            item.setText(3, new_name)
-            item.setText(4, new_value)
+            self.var_model.set_row(row, {0: new_name, 1: new_type, 2: new_role, 3: new_name, 4: new_value})
             dialog.accept()
 
         btn_save.clicked.connect(save_changes)
@@ -636,15 +743,16 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def on_tree_double_click(self, item, column):
+    def on_tree_double_click(self, index):
         """Открывает диалог редактирования переменной или #define."""
-        var_name = item.text(0)
-
-        if item.data(0, QtCore.Qt.UserRole) == "define":
-            define_index = next((i for i, d in enumerate(self.defines) if d.get('name') == var_name), -1)
-            self._edit_define(item, define_index)
+        row = index.row()
+        define_index = self.var_model.tag(row)
+        if define_index is not None:
+            self._edit_define(row, define_index)
             return
 
+        var_name = self.var_model.value(row, 0)
+
         if var_name not in self.variables:
             return
 
@@ -741,14 +849,15 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             new_default = default_edit.text().strip()
 
             if not new_alias:
-                QtWidgets.QMessageBox.warning(dialog, "Ошибка", "Псевдоним не может быть пустым!")
+                self._show_warning("Ошибка", "Псевдоним не может быть пустым!", dialog)
                 return
 
             if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', new_alias):
-                QtWidgets.QMessageBox.warning(
-                    dialog, "Ошибка",
+                self._show_warning(
+                    "Ошибка",
                     "Псевдоним должен начинаться с буквы или подчёркивания\n"
-                    "и содержать только буквы, цифры и подчёркивания!"
+                    "и содержать только буквы, цифры и подчёркивания!",
+                    dialog
                 )
                 return
 
@@ -756,9 +865,7 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
             self.variables[var_name]['alias'] = new_alias
             self.variables[var_name]['default'] = new_default if new_default else None
 
-            item.setText(2, new_role)
-            item.setText(3, new_alias)
-            item.setText(4, new_default)
+            self.var_model.set_row(row, {2: new_role, 3: new_alias, 4: new_default})
 
             dialog.accept()
 
@@ -771,35 +878,57 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
         dialog.setLayout(layout)
         dialog.exec_()
 
-    def generate_block(self):
-        """Генерирует .ubi файл."""
-        log.debug("generate_block: start")
-        try:
+    def _get_alias_renamer(self):
+        """
+        Функция подстановки псевдонимов (один проход по коду).
+        Пересобирается, только если словарь переименований изменился с прошлой сборки.
+        """
+        renames = {
+            var_name: var_info['alias']
+            for var_name, var_info in self.variables.items()
+            if var_info['alias'] != var_name
+        }
+        if self._alias_renamer is None or renames != self._renames:
+            self._renames = renames
+            self._alias_renamer = make_identifier_renamer(renames)
+        return self._alias_renamer
+
+    def _build_xml_content(self, block_name, out=None):
+        """Собирает SIXX XML блока из текущего кода и таблиц переменных/функций (в out — см. create_ubi_xml_sixx)."""
+        if self.code_input.document().revision() == self._parsed_revision:
+            setup_code, loop_code = self._setup_code, self._loop_code
+        else:
+            # Код изменён после последнего парсинга — тела setup/loop извлекаем заново
             code = self.code_input.toPlainText()
             setup_code = extract_function_body(code, 'setup')
             loop_code = extract_function_body(code, 'loop')
 
-            for var_name, var_info in self.variables.items():
-                if var_info['alias'] != var_name:
-                    loop_code = re.sub(r'\b' + var_name + r'\b', var_info['alias'], loop_code)
-                    setup_code = re.sub(r'\b' + var_name + r'\b', var_info['alias'], setup_code)
+        alias_renamer = self._get_alias_renamer()
+        setup_code = alias_renamer(setup_code)
+        loop_code = alias_renamer(loop_code)
+
+        block_description = self.block_description_entry.toPlainText().strip() or DEFAULT_BLOCK_DESCRIPTION
+
+        return create_ubi_xml_sixx(
+            block_name=block_name,
+            block_description=block_description,
+            variables=self.variables,
+            functions=self.functions,
+            global_includes=self.global_includes,
+            defines=self.defines,
+            extra_declarations=self.extra_declarations,
+            static_declarations=self.static_declarations,
+            setup_code=setup_code,
+            loop_code=loop_code,
+            enable_input=self.enable_input_checkbox.isChecked(),
+            out=out,
+        )
 
+    def generate_block(self):
+        """Генерирует .ubi файл."""
+        log.debug("generate_block: start")
+        try:
             block_name = self.block_name_entry.text()
-            block_description = self.block_description_entry.toPlainText().strip() or "Автоматически сгенерированный блок"
-
-            xml_content = create_ubi_xml_sixx(
-                block_name=block_name,
-                block_description=block_description,
-                variables=self.variables,
-                functions=self.functions,
-                global_includes=self.global_includes,
-                defines=self.defines,
-                extra_declarations=self.extra_declarations,
-                static_declarations=self.static_declarations,
-                setup_code=setup_code,
-                loop_code=loop_code,
-                enable_input=self.enable_input_checkbox.isChecked(),
-            )
 
             if (self.last_save_dir and os.path.exists(self.last_save_dir) and
                     "system32" not in os.path.normpath(self.last_save_dir).lower()):
@@ -826,59 +955,19 @@ class ArduinoToFLProgConverter(QtWidgets.QMainWindow):
                 if not filename.endswith('.ubi'):
                     filename += '.ubi'
 
-                with open(filename, 'w', encoding='utf-16') as f:
-                    f.write(xml_content)
+                write_ubi_file(filename, lambda f: self._build_xml_content(block_name, out=f))
 
                 new_dir = os.path.dirname(filename)
                 if new_dir and "system32" not in new_dir.lower():
                     self.last_save_dir = new_dir
 
                 log.info("generate_block: saved %s", filename)
-                QtWidgets.QMessageBox.information(
-                    self, "Успех",
+                self._show_info(
+                    "Успех",
                     "Блок успешно сохранен в формате SIXX:\n{}".format(filename)
                 )
 
         except Exception as e:
             log.exception("generate_block: error %s", e)
             error_msg = "Ошибка при сохранении:\n{}\n\nПодробности:\n{}".format(str(e), traceback.format_exc())
-            QtWidgets.QMessageBox.critical(self, "Ошибка", error_msg)
-
-    def generate_block_to_file(self, filename):
-        """CLI-версия: сохраняет .ubi без диалогов."""
-        try:
-            code = self.code_input.toPlainText()
-            setup_code = extract_function_body(code, 'setup')
-            loop_code = extract_function_body(code, 'loop')
-
-            for var_name, var_info in self.variables.items():
-                if var_info['alias'] != var_name:
-                    loop_code = re.sub(r'\b' + var_name + r'\b', var_info['alias'], loop_code)
-                    setup_code = re.sub(r'\b' + var_name + r'\b', var_info['alias'], setup_code)
-
-            block_name = self.block_name_entry.text()
-            block_description = self.block_description_entry.toPlainText().strip() or "Автоматически сгенерированный блок"
-
-            xml_content = create_ubi_xml_sixx(
-                block_name=block_name,
-                block_description=block_description,
-                variables=self.variables,
-                functions=self.functions,
-                global_includes=self.global_includes,
-                defines=self.defines,
-                extra_declarations=self.extra_declarations,
-                static_declarations=self.static_declarations,
-                setup_code=setup_code,
-                loop_code=loop_code,
-                enable_input=self.enable_input_checkbox.isChecked(),
-            )
-
-            if not filename.endswith('.ubi'):
-                filename += '.ubi'
-
-            with open(filename, 'w', encoding='utf-16') as f:
-                f.write(xml_content)
-
-            return True, filename
-        except Exception as e:
-            return False, "Ошибка при сохранении:\n{}\n\nПодробности:\n{}".format(str(e), traceback.format_exc())
+            self._show_error("Ошибка", error_msg)
@@ -2,56 +2,252 @@
 Парсер Arduino скетчей (.ino) для извлечения переменных, функций, директив.
 """
 
+import copy
 import re
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
 
 from constants import PRIMITIVE_TYPES, DEFINE_TYPE_CHOICES
 
+# Регулярные выражения компилируются один раз при импорте модуля
+_SETUP_RE = re.compile(r'void\s+setup\s*\(')
+_LOOP_RE = re.compile(r'void\s+loop\s*\(')
+_FUNC_DEF_RE = re.compile(
+    r'(void|int|long|bool|boolean|float|double|byte|char|String|uint8_t|int16_t|uint16_t|int32_t|uint32_t)'
+    r'\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)\s*\{'
+)
+# Строка #define целиком (position — начало строки)
+_DEFINE_RE = re.compile(r'^[ \t]*#define[ \t]+([A-Za-z_][A-Za-z0-9_]*)[ \t]*(.*)$', re.MULTILINE)
+# Метка роли в комментарии строки: // in, // out, // par
+_ROLE_RE = re.compile(r'//\s*(in|out|par)\b')
+_ROLE_MAP = {'in': 'input', 'out': 'output', 'par': 'parameter'}
+# Строковый/символьный литерал или комментарий — что встретится раньше
+_STRING_OR_COMMENT_RE = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/|//[^\n]*',
+    re.DOTALL
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+_NEWLINE_RE = re.compile(r'\n')
+_INT_RE = re.compile(r'[+-]?\d+')
+_IDENT_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_')
+_PROTOTYPE_RE = re.compile(r'\w+\s*\([^)]*\)\s*$')
+_STORAGE_QUAL_RE = re.compile(r'^\s*(?:(?:static|const|volatile)\s+)+')
+_STATIC_RE = re.compile(r'^\s*static\b')
+_EXTRA_DECL_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_:<>]*\s+.+$', re.DOTALL)
+_BRACE_RE = re.compile(r'[{}]')
+# Альтернатива примитивных типов (длинные первыми, пробелы внутри типа — \s+)
+_PRIMITIVE_TYPE_REGEX = r'|'.join(
+    re.sub(r'\s+', r'\\s+', re.escape(type_name))
+    for type_name in sorted(PRIMITIVE_TYPES, key=len, reverse=True)
+)
+# Декларация примитивного типа в одну строку (многострочные уходят в extra_declarations как есть)
+_PRIMITIVE_DECL_RE = re.compile(r'^(?P<type>' + _PRIMITIVE_TYPE_REGEX + r')\b\s+(?P<decls>.+)$')
+# Параметр функции: тип (в т.ч. const/unsigned, шаблоны, * и &), имя с [] и необязательное значение по умолчанию
+_PARAM_RE = re.compile(
+    r'(?:^|,)\s*(?P<type>[A-Za-z_][\w:<>\s*&]*?[\s*&])\s*(?P<name>[A-Za-z_]\w*(?:\s*\[[^\]]*\])*)'
+    r'\s*(?:=[^,]*)?(?=,|$)'
+)
+# Пробелы перед * и & в типе параметра: 'const char *' -> 'const char*'
+_PTR_SPACE_RE = re.compile(r'\s+(?=[*&])')
+# Строковый/символьный литерал (незакрытый — до конца текста), скобка или разделитель;
+# на каждый разделитель своя регулярка, чтобы цикл не останавливался на чужих разделителях
+_SCAN_LITERAL = r'"(?:\\[\s\S]|[^"\\])*(?:"|\\?\Z)|\'(?:\\[\s\S]|[^\'\\])*(?:\'|\\?\Z)'
+_SCAN_TOKEN_RES = {
+    delimiter: re.compile(_SCAN_LITERAL + r'|[()\[\]{}' + delimiter + ']')
+    for delimiter in ',='
+}
+# Токены глобальной секции за один проход: директива, комментарий, литерал, скобка, ';'
+_MASTER_RE = re.compile(
+    r'(?P<directive>^[ \t]*#[^\n]*)'
+    r'|(?P<comment>/\*.*?\*/|//[^\n]*)'
+    r'|(?P<literal>' + _SCAN_LITERAL + r')'
+    r'|(?P<bracket>[()\[\]{}])'
+    r'|(?P<semi>;)',
+    re.MULTILINE | re.DOTALL
+)
+
+
+class _DictAccessMixin:
+    """Доступ к полям записи как к словарю: info['type'], info['role'] = ..., info.get('default')."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__dataclass_fields__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__dataclass_fields__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__dataclass_fields__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__dataclass_fields__ else default
+
+
+@dataclass(slots=True)
+class ParsedFunction(_DictAccessMixin):
+    """Пользовательская функция скетча (кроме setup/loop)."""
+    return_type: str
+    params: str
+    parsed_params: list
+    body: str
+    location: str  # "до setup/loop" | "после loop"
+    span: tuple  # (начало определения, позиция после '}') в исходном коде
+
+
+@dataclass(slots=True)
+class ParsedVariable(_DictAccessMixin):
+    """Глобальная переменная скетча."""
+    type: str
+    default: str | None
+    role: str  # "variable" | "input" | "output" | "parameter"
+    alias: str
+    position: int
+
+
+@lru_cache(maxsize=None)
+def _void_func_re(func_name: str) -> re.Pattern:
+    """Регулярка заголовка void func_name() { (кэшируется по имени функции)."""
+    return re.compile(r'void\s+' + re.escape(func_name) + r'\s*\(\s*\)\s*\{')
+
+
+def _mask_literal_or_comment(match: re.Match) -> str:
+    literal = match.group()
+    if literal[0] not in '"\'':
+        return ' ' * len(literal)
+    return literal[0] + ' ' * (len(literal) - 2) + literal[-1]
+
+
+def mask_code(text: str) -> str:
+    """
+    Заменяет пробелами содержимое литералов "..." и '...' (кавычки остаются) и комментарии —
+    за один проход регулярки; позиции символов сохраняются.
+    """
+    return _STRING_OR_COMMENT_RE.sub(_mask_literal_or_comment, text)
 
-def extract_function_body(code: str, func_name: str) -> str:
-    """Извлекает тело функции void func_name() из кода."""
-    pattern = r'void\s+{}\s*\(\s*\)\s*\{{'.format(func_name)
-    match = re.search(pattern, code)
-    if not match:
-        return ""
-    start_pos = match.end()
-    brace_count = 1
-    pos = start_pos
-    while pos < len(code) and brace_count > 0:
+
+def _iter_top_level(text: str, delimiter: str):
+    """
+    Позиции символа delimiter вне скобок (), [], {} и вне строковых литералов.
+    Регулярка перескакивает литералы и незначимые символы, цикл идёт только по скобкам и разделителям.
+    """
+    paren = bracket = brace = 0
+    for m in _SCAN_TOKEN_RES[delimiter].finditer(text):
+        ch = m.group()
+        if ch[0] in '"\'':
+            continue
+        if ch == '(':
+            paren += 1
+        elif ch == ')':
+            paren = max(paren - 1, 0)
+        elif ch == '[':
+            bracket += 1
+        elif ch == ']':
+            bracket = max(bracket - 1, 0)
+        elif ch == '{':
+            brace += 1
+        elif ch == '}':
+            brace = max(brace - 1, 0)
+        elif ch == delimiter and paren == 0 and bracket == 0 and brace == 0:
+            yield m.start()
+
+
+def split_top_level(text: str, delimiter: str) -> list[str]:
+    """Делит text по delimiter верхнего уровня; пустые части отбрасываются."""
+    parts = []
+    prev = 0
+    for pos in _iter_top_level(text, delimiter):
+        part = text[prev:pos].strip()
+        if part:
+            parts.append(part)
+        prev = pos + 1
+    tail = text[prev:].strip()
+    if tail:
+        parts.append(tail)
+    return parts
+
+
+def split_initializer(decl: str) -> tuple[str, str | None]:
+    """Делит декларацию по первому '=' верхнего уровня: (имя, значение | None)."""
+    for idx in _iter_top_level(decl, '='):
+        value_part = decl[idx + 1:].strip()
+        return decl[:idx].strip(), value_part or None
+    return decl.strip(), None
+
+
+def _find_brace_pairs(code: str) -> dict[int, int]:
+    """
+    Сопоставляет позицию каждой '{' с позицией парной '}'. Регулярка перескакивает сразу от скобки к скобке.
+    code должен быть замаскирован (mask_code), чтобы скобки в строках и комментариях не считались.
+    """
+    pairs = {}
+    stack = []
+    for match in _BRACE_RE.finditer(code):
+        pos = match.start()
         if code[pos] == '{':
-            brace_count += 1
-        elif code[pos] == '}':
-            brace_count -= 1
-        pos += 1
-    if brace_count == 0:
-        return code[start_pos:pos - 1].strip()
-    return ""
+            stack.append(pos)
+        elif stack:
+            pairs[stack.pop()] = pos
+    return pairs
 
 
-def extract_custom_function_body(code: str, start_pos: int) -> str:
-    """Извлекает тело пользовательской функции по начальной позиции (после '{')."""
+def _find_closing_brace(code: str, start_pos: int) -> int | None:
+    """Позиция '}', закрывающей блок, который начинается сразу после '{' в start_pos - 1."""
     brace_count = 1
-    pos = start_pos
-    while pos < len(code) and brace_count > 0:
-        if code[pos] == '{':
+    for match in _BRACE_RE.finditer(code, start_pos):
+        if code[match.start()] == '{':
             brace_count += 1
-        elif code[pos] == '}':
+        else:
             brace_count -= 1
-        pos += 1
-    if brace_count == 0:
-        return code[start_pos:pos - 1].strip()
-    return ""
+            if brace_count == 0:
+                return match.start()
+    return None
+
+
+def extract_function_body(code: str, func_name: str, brace_pairs: dict | None = None) -> str:
+    """Извлекает тело функции void func_name() из кода."""
+    match = _void_func_re(func_name).search(code)
+    if not match:
+        return ""
+    return extract_custom_function_body(code, match.end(), brace_pairs)
+
+
+def extract_custom_function_body(code: str, start_pos: int, brace_pairs: dict | None = None) -> str:
+    """
+    Извлекает тело пользовательской функции по начальной позиции (после '{').
+    brace_pairs — заранее посчитанные пары скобок (_find_brace_pairs), тогда поиск конца — O(1).
+    """
+    end_pos = _function_body_end(code, start_pos, brace_pairs)
+    if end_pos is None:
+        return ""
+    return code[start_pos:end_pos].strip()
+
+
+def _function_body_end(code: str, start_pos: int, brace_pairs: dict | None = None) -> int | None:
+    """Позиция '}', закрывающей тело функции, которое начинается в start_pos (после '{')."""
+    if brace_pairs is None:
+        return _find_closing_brace(mask_code(code), start_pos)
+    return brace_pairs.get(start_pos - 1)
+
+
+def _first_func_pos(code: str) -> int:
+    """Позиция первого из setup/loop (или длина кода, если их нет)."""
+    setup_match = _SETUP_RE.search(code)
+    loop_match = _LOOP_RE.search(code)
+    setup_pos = setup_match.start() if setup_match else len(code)
+    loop_pos = loop_match.start() if loop_match else len(code)
+    return min(setup_pos, loop_pos)
 
 
 def extract_global_section(code: str) -> str:
     """Извлекает глобальную секцию кода (до setup/loop)."""
-    setup_match = re.search(r'void\s+setup\s*\(', code)
-    loop_match = re.search(r'void\s+loop\s*\(', code)
-    first_func_pos = len(code)
-    if setup_match and setup_match.start() < first_func_pos:
-        first_func_pos = setup_match.start()
-    if loop_match and loop_match.start() < first_func_pos:
-        first_func_pos = loop_match.start()
-    return code[:first_func_pos].strip()
+    return code[:_first_func_pos(code)].strip()
 
 
 def extract_leading_comment(code: str) -> str | None:
@@ -80,10 +276,9 @@ def extract_leading_comment(code: str) -> str | None:
             line_end = code.find("\n", pos)
             if line_end == -1:
                 line_end = n
-            line = code[pos:line_end]
-            if line.strip().startswith("//"):
-                clean = re.sub(r'^\s*//\s*', '', line).rstrip()
-                lines.append(clean)
+            stripped = code[pos:line_end].lstrip()
+            if stripped.startswith("//"):
+                lines.append(stripped[2:].strip())
                 pos = line_end + 1
             else:
                 break
@@ -95,27 +290,25 @@ def extract_leading_comment(code: str) -> str | None:
 
 def parse_function_params(params_str: str) -> list[dict]:
     """Парсит строку параметров функции в список словарей с type и name."""
-    if not params_str or params_str.strip() == '':
-        return []
-    params = []
-    param_list = params_str.split(',')
-    for param in param_list:
-        param = param.strip()
-        if not param:
-            continue
-        parts = param.split()
-        if len(parts) >= 2:
-            param_type = parts[0]
-            param_name = parts[1]
-            params.append({'type': param_type, 'name': param_name})
-    return params
-
-
-def parse_functions(code: str) -> dict:
-    """Парсит все пользовательские функции (кроме setup и loop)."""
-    func_pattern = r'(void|int|long|bool|boolean|float|double|byte|char|String|uint8_t|int16_t|uint16_t|int32_t|uint32_t)\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)\s*\{'
-    matches = list(re.finditer(func_pattern, code))
+    return [
+        {'type': _PTR_SPACE_RE.sub('', _WHITESPACE_RE.sub(' ', m.group('type').strip())), 'name': m.group('name')}
+        for m in _PARAM_RE.finditer(params_str)
+    ]
+
+
+def parse_functions(code: str, brace_pairs: dict | None = None) -> tuple[dict, list]:
+    """
+    Парсит все пользовательские функции (кроме setup и loop).
+    Возвращает (functions, spans_before_setup): functions — по имени (из перегрузок остаётся последняя),
+    spans_before_setup — span всех определений до setup/loop, включая каждую перегрузку.
+    """
+    if brace_pairs is None:
+        brace_pairs = _find_brace_pairs(mask_code(code))
+    matches = list(_FUNC_DEF_RE.finditer(code))
     functions = {}
+    spans_before_setup = []
+    # Граница «до setup/loop» одна для всех функций — ищем её один раз
+    first_func_pos = _first_func_pos(code)
 
     for match in matches:
         func_name = match.group(2)
@@ -125,92 +318,230 @@ def parse_functions(code: str) -> dict:
         return_type = match.group(1).strip()
         params_str = match.group(3).strip()
         body_start = match.end()
-        func_body = extract_custom_function_body(code, body_start)
+        body_end = _function_body_end(code, body_start, brace_pairs)
+        func_body = code[body_start:body_end].strip() if body_end is not None else ""
+        # span — границы определения в code (от типа до '}' включительно), для вырезания из глобальной секции
+        span = (match.start(), body_end + 1 if body_end is not None else body_start)
         parsed_params = parse_function_params(params_str)
 
-        func_pos = match.start()
-        setup_pos = len(code)
-        loop_pos = len(code)
-        if setup_match := re.search(r'void\s+setup\s*\(', code):
-            setup_pos = setup_match.start()
-        if loop_match := re.search(r'void\s+loop\s*\(', code):
-            loop_pos = loop_match.start()
-        first_func_pos = min(setup_pos, loop_pos)
+        before_setup = match.start() < first_func_pos
+        location = "до setup/loop" if before_setup else "после loop"
+        if before_setup:
+            spans_before_setup.append(span)
+
+        functions[func_name] = ParsedFunction(
+            return_type=return_type,
+            params=params_str,
+            parsed_params=parsed_params,
+            body=func_body,
+            location=location,
+            span=span
+        )
 
-        location = "до setup/loop" if func_pos < first_func_pos else "после loop"
+    return functions, spans_before_setup
 
-        functions[func_name] = {
-            'return_type': return_type,
-            'params': params_str,
-            'parsed_params': parsed_params,
-            'body': func_body,
-            'location': location
-        }
 
-    return functions
+def normalize_type(type_name: str) -> str:
+    return _WHITESPACE_RE.sub(' ', type_name.strip())
+
+
+def extract_name(name_part: str) -> str | None:
+    """Последний идентификатор в name_part (foo, *foo, foo[10] -> foo); ищется с конца строки без списка совпадений."""
+    end = len(name_part)
+    while end > 0:
+        while end > 0 and name_part[end - 1] not in _IDENT_CHARS:
+            end -= 1
+        start = end
+        while start > 0 and name_part[start - 1] in _IDENT_CHARS:
+            start -= 1
+        # Идентификатор не начинается с цифры: 10 в foo[10] пропускаем, у 9abc берём abc
+        name = name_part[start:end].lstrip('0123456789')
+        if name:
+            return name
+        end = start
+    return None
+
+
+def _scan_global_section(section: str) -> tuple[list, list, list]:
+    """
+    Один проход _MASTER_RE по глобальной секции.
+    Возвращает (statements, includes, define_matches): операторы [(текст, позиция начала)] по ';' верхнего уровня
+    (директивы и комментарии в тексте заменены пробелами), строки #include и совпадения _DEFINE_RE.
+    """
+    includes = []
+    define_matches = []
+    boundaries = []
+    pieces = []
+    prev = 0
+    stmt_start = 0
+    paren = bracket = brace = 0
+    for m in _MASTER_RE.finditer(section):
+        kind = m.lastgroup
+        if kind == 'semi':
+            if paren == 0 and bracket == 0 and brace == 0:
+                boundaries.append((stmt_start, m.start()))
+                stmt_start = m.end()
+            continue
+        if kind == 'bracket':
+            ch = m.group()
+            if ch == '(':
+                paren += 1
+            elif ch == ')':
+                paren = max(paren - 1, 0)
+            elif ch == '[':
+                bracket += 1
+            elif ch == ']':
+                bracket = max(bracket - 1, 0)
+            elif ch == '{':
+                brace += 1
+            else:
+                brace = max(brace - 1, 0)
+            continue
+        if kind == 'literal':
+            continue
+        # Директива или комментарий: в тексте операторов заменяются пробелами той же длины
+        start, end = m.span()
+        if kind == 'directive':
+            line = m.group().strip()
+            if line.startswith('#include'):
+                includes.append(line)
+            elif line.startswith('#define'):
+                define_match = _DEFINE_RE.match(section, start, end)
+                if define_match:
+                    define_matches.append(define_match)
+        pieces.append(section[prev:start])
+        pieces.append(' ' * (end - start))
+        prev = end
+    pieces.append(section[prev:])
+    masked = ''.join(pieces)
+
+    statements = []
+    for start, end in boundaries:
+        statement = masked[start:end].strip()
+        if statement:
+            statements.append((statement, start))
+    return statements, includes, define_matches
+
+
+def infer_define_type(value: str) -> str:
+    """Определяет тип define по значению: кавычки -> String, true/false -> boolean, с запятой/точкой -> float, число -> long."""
+    if not value:
+        return 'String'
+    s = value.strip()
+    if not s:
+        return 'String'
+    # Выбор ветки по первому символу: нечисловые значения не доходят до int()/float() с исключениями
+    c = s[0]
+    if c in 'tTfF':
+        return 'boolean' if s.lower() in ('true', 'false') else 'String'
+    if not (c.isdigit() or c in '+-.,'):
+        return 'String'
+    if _INT_RE.fullmatch(s):
+        return 'long'
+    if ',' in s or '.' in s:
+        try:
+            float(s.replace(',', '.', 1))
+            return 'float'
+        except ValueError:
+            pass
+    try:
+        int(s)
+        return 'long'
+    except ValueError:
+        pass
+    return 'String'
+
+
+@lru_cache(maxsize=4096)
+def _parse_global_statement(statement: str) -> tuple | None:
+    """
+    Разбор одного оператора глобальной секции без привязки к позиции и роли.
+    Кэшируется по тексту оператора: при повторном парсинге после правки
+    заново разбираются только изменившиеся операторы.
+    Возвращает None (пропустить), ('static', (строки,)), ('extra', строка)
+    или ('vars', (тип, ((имя, значение | None), ...))).
+    """
+    stmt = statement.strip()
+    if not stmt or stmt.startswith('#'):
+        return None
+
+    # Исключаем прототипы функций
+    if _PROTOTYPE_RE.search(stmt) and '=' not in stmt:
+        return None
+
+    # Убираем базовые квалификаторы хранения
+    stmt_no_qual = _STORAGE_QUAL_RE.sub('', stmt)
+    is_static = bool(_STATIC_RE.match(stmt))
+
+    primitive_match = _PRIMITIVE_DECL_RE.match(stmt_no_qual)
+
+    if primitive_match:
+        var_type = primitive_match.group('type')
+        if var_type not in PRIMITIVE_TYPES:
+            # Составной тип с лишними пробелами (unsigned   long) приводим к каноническому виду
+            var_type = normalize_type(var_type)
+        decls = primitive_match.group('decls').strip()
+        if is_static:
+            return 'static', tuple(
+                "static " + var_type + " " + decl.strip() + ";"
+                for decl in split_top_level(decls, ',')
+                if decl.strip()
+            )
+        parsed_decls = []
+        for decl in split_top_level(decls, ','):
+            name_part, value_part = split_initializer(decl)
+            var_name = extract_name(name_part)
+            if var_name:
+                parsed_decls.append((var_name, value_part))
+        return 'vars', (var_type, tuple(parsed_decls))
+
+    # Остальные декларации сохраняем как есть (в т.ч. многострочные typedef struct/enum)
+    if _EXTRA_DECL_RE.match(stmt):
+        return 'extra', stmt + ';'
+    return None
 
 
 def parse_global_section(
     global_section: str,
-    functions: dict
+    function_spans: list,
+    section_offset: int = 0
 ) -> tuple[dict, list, list, list]:
     """
     Парсит глобальную секцию кода.
     Возвращает: (variables, global_includes, defines, extra_declarations, static_declarations)
     defines — список словарей {name, value, role} с ролями "global" | "parameter".
     static_declarations — список строк "static type name [= val];" (в GUI не показываются, передаются в генератор).
+    function_spans — span всех определений функций до setup/loop (см. parse_functions).
+    section_offset — позиция начала global_section в исходном коде (span функций заданы в его координатах).
     """
-    # Убираем функции, определённые до setup/loop
-    section = global_section
-    for func_name, func_info in functions.items():
-        if func_info['location'] == "до setup/loop":
-            func_pattern = r'(void|int|long|bool|boolean|float|double|byte|char|String)\s+{}\s*\([^)]*\)\s*\{{[^}}]*\}}'.format(func_name)
-            section = re.sub(func_pattern, '', section, flags=re.DOTALL)
-
-    # Парсим директивы #include и #define
-    include_pattern = r'^\s*#include[^\n]*$'
-    global_includes = re.findall(include_pattern, section, re.MULTILINE)
-
-    def infer_define_type(value: str) -> str:
-        """Определяет тип define по значению: кавычки -> String, true/false -> boolean, с запятой/точкой -> float, число -> long."""
-        if not value:
-            return 'String'
-        s = value.strip()
-        if (s.startswith('"') and s.endswith('"')) or (s.startswith("'") and s.endswith("'")):
-            return 'String'
-        if s.lower() in ('true', 'false'):
-            return 'boolean'
-        if ',' in s or '.' in s:
-            try:
-                float(s.replace(',', '.', 1))
-                return 'float'
-            except ValueError:
-                pass
-        try:
-            int(s)
-            return 'long'
-        except ValueError:
-            pass
-        return 'String'
+    # Убираем функции, определённые до setup/loop: склеиваем промежутки между их span
+    spans = sorted(function_spans)
+    if spans:
+        pieces = []
+        prev = 0
+        for start, end in spans:
+            start = max(start - section_offset, prev)
+            end = min(end - section_offset, len(global_section))
+            if start >= end:
+                continue
+            pieces.append(global_section[prev:start])
+            prev = end
+        pieces.append(global_section[prev:])
+        section = ''.join(pieces)
+    else:
+        section = global_section
+
+    statements, global_includes, define_matches = _scan_global_section(section)
 
     # #define обрабатываются как переменные с двумя ролями: global и parameter; value — значение по умолчанию
     defines = []
-    line_offset = 0
-    for line in section.split('\n'):
-        stripped = line.strip()
-        if not stripped.startswith('#define'):
-            line_offset += len(line) + 1
-            continue
-        m = re.match(r'#define\s+([A-Za-z_][A-Za-z0-9_]*)\s*(.*)$', stripped)
-        if not m:
-            line_offset += len(line) + 1
-            continue
+    for m in define_matches:
         name, rest = m.group(1), m.group(2).strip()
-        role = 'parameter' if re.search(r'//\s*par\b', rest) else 'global'
+        role_match = _ROLE_RE.search(rest)
+        role = 'parameter' if role_match and role_match.group(1) == 'par' else 'global'
         value = rest.split('//')[0].strip() if '//' in rest else rest
         define_type = infer_define_type(value)
-        defines.append({'name': name, 'value': value, 'role': role, 'type': define_type, 'position': line_offset})
-        line_offset += len(line) + 1
+        defines.append({'name': name, 'value': value, 'role': role, 'type': define_type, 'position': m.start()})
 
     # Парсим глобальные переменные (поддержка множественных деклараций через запятую)
     # static-переменные не попадают в variables, а уходят в static_declarations и передаются в генератор
@@ -218,251 +549,76 @@ def parse_global_section(
     extra_declarations = []
     static_declarations = []
 
-    primitive_types = sorted(PRIMITIVE_TYPES, key=len, reverse=True)
-    primitive_type_patterns = [
-        re.sub(r'\s+', r'\\s+', re.escape(type_name)) for type_name in primitive_types
-    ]
-    primitive_type_regex = r'|'.join(primitive_type_patterns)
-
-    def normalize_type(type_name: str) -> str:
-        return re.sub(r'\s+', ' ', type_name.strip())
-
-    def split_top_level(text: str, delimiter: str) -> list[str]:
-        parts = []
-        buf = []
-        paren = bracket = brace = 0
-        in_string = False
-        string_char = ''
-        escape = False
-        for ch in text:
-            if in_string:
-                buf.append(ch)
-                if escape:
-                    escape = False
-                elif ch == '\\':
-                    escape = True
-                elif ch == string_char:
-                    in_string = False
-                continue
-            if ch in ('"', "'"):
-                in_string = True
-                string_char = ch
-                buf.append(ch)
-                continue
-            if ch == '(':
-                paren += 1
-            elif ch == ')':
-                paren = max(paren - 1, 0)
-            elif ch == '[':
-                bracket += 1
-            elif ch == ']':
-                bracket = max(bracket - 1, 0)
-            elif ch == '{':
-                brace += 1
-            elif ch == '}':
-                brace = max(brace - 1, 0)
-            if (
-                ch == delimiter
-                and paren == 0
-                and bracket == 0
-                and brace == 0
-            ):
-                part = ''.join(buf).strip()
-                if part:
-                    parts.append(part)
-                buf = []
-            else:
-                buf.append(ch)
-        tail = ''.join(buf).strip()
-        if tail:
-            parts.append(tail)
-        return parts
-
-    def split_initializer(decl: str) -> tuple[str, str | None]:
-        paren = bracket = brace = 0
-        in_string = False
-        string_char = ''
-        escape = False
-        for idx, ch in enumerate(decl):
-            if in_string:
-                if escape:
-                    escape = False
-                elif ch == '\\':
-                    escape = True
-                elif ch == string_char:
-                    in_string = False
-                continue
-            if ch in ('"', "'"):
-                in_string = True
-                string_char = ch
-                continue
-            if ch == '(':
-                paren += 1
-            elif ch == ')':
-                paren = max(paren - 1, 0)
-            elif ch == '[':
-                bracket += 1
-            elif ch == ']':
-                bracket = max(bracket - 1, 0)
-            elif ch == '{':
-                brace += 1
-            elif ch == '}':
-                brace = max(brace - 1, 0)
-            if (
-                ch == '='
-                and paren == 0
-                and bracket == 0
-                and brace == 0
-            ):
-                name_part = decl[:idx].strip()
-                value_part = decl[idx + 1:].strip()
-                return name_part, value_part or None
-        return decl.strip(), None
-
-    def extract_name(name_part: str) -> str | None:
-        match = re.findall(r'[A-Za-z_][A-Za-z0-9_]*', name_part)
-        return match[-1] if match else None
-
-    def split_statements(text: str) -> list[tuple[str, int]]:
-        statements = []
-        buf = []
-        paren = bracket = brace = 0
-        in_string = False
-        string_char = ''
-        escape = False
-        start_idx = 0
-        for idx, ch in enumerate(text):
-            if in_string:
-                buf.append(ch)
-                if escape:
-                    escape = False
-                elif ch == '\\':
-                    escape = True
-                elif ch == string_char:
-                    in_string = False
-                continue
-            if ch in ('"', "'"):
-                in_string = True
-                string_char = ch
-                buf.append(ch)
-                continue
-            if ch == '(':
-                paren += 1
-            elif ch == ')':
-                paren = max(paren - 1, 0)
-            elif ch == '[':
-                bracket += 1
-            elif ch == ']':
-                bracket = max(bracket - 1, 0)
-            elif ch == '{':
-                brace += 1
-            elif ch == '}':
-                brace = max(brace - 1, 0)
-            if ch == ';' and paren == 0 and bracket == 0 and brace == 0:
-                statement = ''.join(buf).strip()
-                if statement:
-                    statements.append((statement, start_idx))
-                buf = []
-                start_idx = idx + 1
-            else:
-                buf.append(ch)
-        return statements
-
-    def mask_directives(text: str) -> str:
-        def repl(match: re.Match) -> str:
-            return ' ' * (match.end() - match.start())
-        return re.sub(r'^[ \t]*#.*$', repl, text, flags=re.MULTILINE)
-
-    def mask_comments(text: str) -> str:
-        def repl(match: re.Match) -> str:
-            return ' ' * (match.end() - match.start())
-        text = re.sub(r'/\*.*?\*/', repl, text, flags=re.DOTALL)
-        text = re.sub(r'//[^\n]*', repl, text)
-        return text
-
-    masked_section = mask_comments(mask_directives(section))
-
-    for statement, start_idx in split_statements(masked_section):
-        stmt = statement.strip()
-        if not stmt or stmt.startswith('#'):
+    newline_positions = [m.start() for m in _NEWLINE_RE.finditer(section)]
+
+    for statement, start_idx in statements:
+        parsed = _parse_global_statement(statement)
+        if parsed is None:
             continue
+        kind, payload = parsed
 
-        # Исключаем прототипы функций
-        if re.search(r'\w+\s*\([^)]*\)\s*$', stmt) and '=' not in stmt:
+        if kind == 'static':
+            static_declarations.extend(payload)
+            continue
+        if kind == 'extra':
+            extra_declarations.append(payload)
             continue
 
-        line_start = section.rfind('\n', 0, start_idx) + 1
-        line_end = section.find('\n', start_idx)
-        if line_end == -1:
-            line_end = len(section)
+        # Строка, в которой начинается оператор: соседние переводы строк ищутся бинарным поиском
+        k = bisect_left(newline_positions, start_idx)
+        line_start = newline_positions[k - 1] + 1 if k else 0
+        line_end = newline_positions[k] if k < len(newline_positions) else len(section)
         line_text = section[line_start:line_end]
 
-        role = 'variable'
-        if re.search(r'//\s*in\b', line_text):
-            role = 'input'
-        elif re.search(r'//\s*out\b', line_text):
-            role = 'output'
-        elif re.search(r'//\s*par\b', line_text):
-            role = 'parameter'
-
-        # Убираем базовые квалификаторы хранения
-        stmt_no_qual = re.sub(r'^\s*(?:(?:static|const|volatile)\s+)+', '', stmt)
-        is_static = bool(re.match(r'^\s*static\b', stmt))
-
-        primitive_match = re.match(
-            r'^(?P<type>{})\b\s+(?P<decls>.+)$'.format(primitive_type_regex),
-            stmt_no_qual
-        )
-
-        if primitive_match:
-            var_type = normalize_type(primitive_match.group('type'))
-            decls = primitive_match.group('decls').strip()
-            if is_static:
-                for decl in split_top_level(decls, ','):
-                    one_decl = (decl or '').strip()
-                    if one_decl:
-                        static_declarations.append("static " + var_type + " " + one_decl + ";")
-                continue
-            for decl in split_top_level(decls, ','):
-                name_part, value_part = split_initializer(decl)
-                var_name = extract_name(name_part)
-                if not var_name:
-                    continue
-                variables[var_name] = {
-                    'type': var_type,
-                    'default': value_part,
-                    'role': role,
-                    'alias': var_name,
-                    'position': start_idx
-                }
-            continue
+        role_match = _ROLE_RE.search(line_text)
+        role = _ROLE_MAP[role_match.group(1)] if role_match else 'variable'
 
-        # Остальные декларации сохраняем как есть (в т.ч. многострочные typedef struct/enum)
-        if re.match(r'^[A-Za-z_][A-Za-z0-9_:<>]*\s+.+$', stmt, re.DOTALL):
-            extra_declarations.append(stmt + ';')
+        var_type, decls = payload
+        for var_name, value_part in decls:
+            variables[var_name] = ParsedVariable(
+                type=var_type,
+                default=value_part,
+                role=role,
+                alias=var_name,
+                position=start_idx
+            )
 
     return variables, global_includes, defines, extra_declarations, static_declarations
 
 
 def parse_arduino_code(code: str) -> dict:
     """
-    Парсит полный Arduino скетч.
-    Возвращает словарь:
+    Парсит полный Arduino скетч; разбор кэшируется по тексту кода.
+    Каждый вызов возвращает собственную глубокую копию результата — вызывающий код может изменять
+    её (и вложенные dict/list/записи), не затрагивая кэш и последующие вызовы с тем же кодом:
     - leading_comment: str | None
-    - variables: dict
-    - functions: dict
+    - variables: dict[str, ParsedVariable]
+    - functions: dict[str, ParsedFunction]
     - global_section_raw: str
     - global_includes: list
     - defines: list[{name, value, role}] — #define как переменные с ролями global | parameter
     - extra_declarations: list
     - static_declarations: list — static-переменные (передаются в генератор, в GUI не показываются)
+    - setup_body: str — тело setup()
+    - loop_body: str — тело loop()
     """
+    return copy.deepcopy(_parse_arduino_code_impl(code))
+
+
+@lru_cache(maxsize=16)
+def _parse_arduino_code_impl(code: str) -> dict:
     leading_comment = extract_leading_comment(code)
-    functions = parse_functions(code)
+    # Пары скобок считаются один раз по коду без строк и комментариев и используются для всех тел функций;
+    # сами тела вырезаются из исходного кода
+    masked_code = mask_code(code)
+    brace_pairs = _find_brace_pairs(masked_code)
+    functions, function_spans = parse_functions(code, brace_pairs)
     global_section_raw = extract_global_section(code)
+    # extract_global_section обрезает ведущие пробелы — смещение секции относительно code
+    section_offset = len(code) - len(code.lstrip())
 
     variables, global_includes, defines, extra_declarations, static_declarations = parse_global_section(
-        global_section_raw, functions
+        global_section_raw, function_spans, section_offset
     )
 
     return {
@@ -474,4 +630,6 @@ def parse_arduino_code(code: str) -> dict:
         'defines': defines,
         'extra_declarations': extra_declarations,
         'static_declarations': static_declarations,
+        'setup_body': extract_function_body(code, 'setup', brace_pairs),
+        'loop_body': extract_function_body(code, 'loop', brace_pairs),
     }
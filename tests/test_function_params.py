@@ -0,0 +1,63 @@
+"""Проверка: параметры функций со ссылками, указателями и шаблонами дают корректный XML."""
+
+import os
+import sys
+import unittest
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from generator import create_ubi_xml_sixx
+from parser import parse_arduino_code, parse_function_params
+
+SKETCH = '''
+void f(String &s, std::vector<int> v, const char *p) {
+  Serial.println(s);
+}
+
+void setup() {
+}
+
+void loop() {
+}
+'''
+
+
+class FunctionParamsTest(unittest.TestCase):
+    def test_types_normalized(self):
+        self.assertEqual(
+            parse_function_params('String &s, std::vector<int> v, const char *p'),
+            [
+                {'type': 'String&', 'name': 's'},
+                {'type': 'std::vector<int>', 'name': 'v'},
+                {'type': 'const char*', 'name': 'p'},
+            ],
+        )
+
+    def test_xml_well_formed(self):
+        result = parse_arduino_code(SKETCH)
+        xml = create_ubi_xml_sixx(
+            block_name='Test',
+            block_description='Test',
+            variables=result['variables'],
+            functions=result['functions'],
+            global_includes=result['global_includes'],
+            defines=result['defines'],
+            extra_declarations=result['extra_declarations'],
+            static_declarations=result['static_declarations'],
+            setup_code=result['setup_body'],
+            loop_code=result['loop_body'],
+        )
+        doc = minidom.parseString(xml)
+        declares = [
+            node.firstChild.data
+            for node in doc.getElementsByTagName('sixx.object')
+            if node.getAttribute('sixx.name') == 'declare' and node.firstChild is not None
+        ]
+        self.assertIn('String&', declares)
+        self.assertIn('std::vector<int>', declares)
+        self.assertIn('const char*', declares)
+
+
+if __name__ == '__main__':
+    unittest.main()
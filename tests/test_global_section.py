@@ -0,0 +1,40 @@
+"""Проверка: перегрузки функций до setup/loop вырезаются из глобальной секции целиком."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from parser import parse_arduino_code
+
+SKETCH = '''
+void show(int v) {
+  Serial.println(v);
+}
+
+void show(float v) {
+  Serial.println(v);
+}
+
+int count = 1;
+
+void setup() {
+}
+
+void loop() {
+  show(count);
+}
+'''
+
+
+class GlobalSectionTest(unittest.TestCase):
+    def test_overloads_before_setup(self):
+        result = parse_arduino_code(SKETCH)
+        self.assertIn('count', result['variables'])
+        self.assertEqual(result['variables']['count']['default'], '1')
+        self.assertEqual(list(result['extra_declarations']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()